@@ -74,6 +74,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # a file rather than the in-memory default, so the concurrency
+        # tests can write to it from several threads
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -165,6 +168,17 @@ USE_TZ = True
 
 
 
+# file cache so every gunicorn worker on the box sees the same dashboard
+# fragments and invalidations
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('DJANGO_CACHE_DIR', str(BASE_DIR / 'cache')),
+        'TIMEOUT': 300,
+    }
+}
+
+
 # static files config, for css/js/images
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
@@ -173,6 +187,10 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# finished background job files (exports, label PDFs); kept outside MEDIA_ROOT
+# so they are only reachable through the permission-checked download view
+JOB_FILES_DIR = os.getenv('DJANGO_JOB_FILES_DIR', str(BASE_DIR / 'job_files'))
+
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
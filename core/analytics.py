@@ -0,0 +1,268 @@
+"""
+In-memory sales cube for ad-hoc pivots.
+
+Sold order lines are loaded once per process into NumPy columns, with
+brand, category, location, cashier and product dictionary-encoded as small
+integers and the local day/hour precomputed. Any pair of dimensions can
+then be pivoted with np.bincount over the filtered columns,
+which takes milliseconds for millions of lines, instead of a separate ORM
+aggregate per breakdown.
+
+The cube is topped up from the newest order id; orders are append-only
+once rung up, so only lines of new orders need loading. The last
+REFRESH_OVERLAP orders are reloaded every time, to pick up transactions
+that committed out of id order. Figures are lines as rung up (gross, before
+returns), like the sales columns of the rollups.
+
+NumPy is optional: without it ``available()`` is False and the pivot API
+says so instead of failing.
+"""
+import threading
+
+from django.utils import timezone
+
+from .models import Location, Order, OrderItem, Product, User
+from .rollups import SOLD_STATUSES, SOLD_TYPES
+
+try:
+    import numpy as np
+except ImportError:  # only the pivot API needs it
+    np = None
+
+# orders below the newest loaded id that are reloaded on every refresh
+REFRESH_OVERLAP = 200
+LOAD_CHUNK = 5000
+MAX_COLUMNS = 100
+
+CATEGORICAL = ('brand', 'category', 'location', 'cashier', 'product')
+TEMPORAL = ('day', 'week', 'month', 'hour', 'weekday')
+DIMENSIONS = CATEGORICAL + TEMPORAL
+MEASURES = ('revenue', 'quantity', 'cost', 'profit', 'lines')
+# categorical dimensions whose values are ids, labelled from these models
+ID_LABELS = {
+    'location': (Location, 'name'),
+    'cashier': (User, 'username'),
+    'product': (Product, 'name'),
+}
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+
+def available():
+    return np is not None
+
+
+class _Dictionary:
+    """Maps values to dense integer codes and back"""
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class SalesCube:
+    def __init__(self):
+        self.last_order_id = 0
+        self.dictionaries = {dimension: _Dictionary() for dimension in CATEGORICAL}
+        self.columns = self._empty()
+
+    @staticmethod
+    def _empty():
+        return {
+            'order_id': np.empty(0, dtype=np.int64),
+            'day': np.empty(0, dtype='datetime64[D]'),
+            'hour': np.empty(0, dtype=np.int8),
+            **{dimension: np.empty(0, dtype=np.int32) for dimension in CATEGORICAL},
+            'quantity': np.empty(0, dtype=np.int32),
+            'revenue': np.empty(0, dtype=np.float64),
+            'cost': np.empty(0, dtype=np.float64),
+        }
+
+    def __len__(self):
+        return len(self.columns['order_id'])
+
+    def refresh(self):
+        """Loads lines of orders newer than the last refresh. Returns the number of lines loaded."""
+        newest = Order.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        if newest <= self.last_order_id:
+            return 0
+        since = max(0, self.last_order_id - REFRESH_OVERLAP)
+        fresh = self._load(since)
+        keep = self.columns['order_id'] <= since
+        self.columns = {
+            name: np.concatenate([column[keep], fresh[name]]) for name, column in self.columns.items()
+        }
+        self.last_order_id = newest
+        return len(fresh['order_id'])
+
+    def _load(self, since):
+        lines = (
+            OrderItem.objects.filter(order__status__in=SOLD_STATUSES, order__type__in=SOLD_TYPES, order_id__gt=since)
+            .values_list('order_id', 'order__created_at', 'order__location_id', 'order__created_by_id',
+                         'variant__product_id', 'variant__product__brand', 'variant__product__category',
+                         'quantity', 'unit_price', 'unit_cost')
+            .order_by('order_id')
+        )
+        encode = {dimension: dictionary.encode for dimension, dictionary in self.dictionaries.items()}
+        rows = {name: [] for name in self.columns}
+        current_order, day, hour = None, None, None
+        for order_id, created_at, location_id, cashier_id, product_id, brand, category, qty, price, cost in lines.iterator(chunk_size=LOAD_CHUNK):
+            if order_id != current_order:
+                local = timezone.localtime(created_at)
+                current_order, day, hour = order_id, local.date(), local.hour
+            rows['order_id'].append(order_id)
+            rows['day'].append(day)
+            rows['hour'].append(hour)
+            rows['brand'].append(encode['brand'](brand))
+            rows['category'].append(encode['category'](category))
+            rows['location'].append(encode['location'](location_id))
+            rows['cashier'].append(encode['cashier'](cashier_id))
+            rows['product'].append(encode['product'](product_id))
+            rows['quantity'].append(qty)
+            rows['revenue'].append(float(price) * qty)
+            rows['cost'].append(float(cost or 0) * qty)
+        return {name: np.array(values, dtype=self.columns[name].dtype) for name, values in rows.items()}
+
+    def _measure(self, measure, columns, mask):
+        if measure == 'lines':
+            return None
+        if measure == 'profit':
+            return columns['revenue'][mask] - columns['cost'][mask]
+        return columns[measure][mask].astype(np.float64)
+
+    def _codes(self, dimension, data, mask):
+        """
+        (codes, keys) for the masked lines: dense integer group codes in
+        [0, len(keys)) and the dimension value each code stands for, so
+        grouping is a bincount rather than a sort.
+        """
+        if dimension in CATEGORICAL:
+            return data[dimension][mask].astype(np.intp), np.arange(len(self.dictionaries[dimension].values))
+        if dimension == 'hour':
+            return data['hour'][mask].astype(np.intp), np.arange(24)
+        days = data['day'][mask].astype(np.int64)
+        # 1970-01-01 was a Thursday, so (n + 3) % 7 counts from Monday
+        weekday = (days + 3) % 7
+        if dimension == 'weekday':
+            return weekday.astype(np.intp), np.arange(7)
+        if dimension == 'month':
+            values, unit, step = data['day'][mask].astype('datetime64[M]').astype(np.int64), 'datetime64[M]', 1
+        elif dimension == 'week':
+            values, unit, step = days - weekday, 'datetime64[D]', 7
+        else:
+            values, unit, step = days, 'datetime64[D]', 1
+        if not len(values):
+            return values.astype(np.intp), np.empty(0, dtype=unit)
+        base = values.min()
+        codes = ((values - base) // step).astype(np.intp)
+        return codes, (base + step * np.arange(codes.max() + 1)).astype(unit)
+
+    def _labels(self, dimension, keys):
+        if dimension in ('day', 'week', 'month'):
+            return [str(key) for key in keys]
+        if dimension == 'hour':
+            return [f'{int(key):02d}:00' for key in keys]
+        if dimension == 'weekday':
+            return [WEEKDAYS[int(key)] for key in keys]
+        values = [self.dictionaries[dimension].values[int(key)] for key in keys]
+        if dimension in ID_LABELS:
+            model, field = ID_LABELS[dimension]
+            names = dict(model.objects.filter(id__in=[v for v in values if v is not None]).values_list('id', field))
+            return [names.get(value, 'Unknown') for value in values]
+        return [value or 'Unknown' for value in values]
+
+    def pivot(self, rows, columns=None, measure='revenue', start=None, end=None, filters=None, limit=None):
+        """
+        Totals of ``measure`` grouped by the ``rows`` dimension, and by
+        ``columns`` too when given, over lines sold between ``start`` and
+        ``end`` (dates, inclusive). ``filters`` maps categorical dimensions
+        to a value (a brand / category name, or a location, cashier or
+        product id). Categorical rows are ordered by total, largest first,
+        and cut to ``limit``; time dimensions stay in time order.
+        """
+        if rows not in DIMENSIONS or (columns is not None and columns not in DIMENSIONS):
+            raise ValueError(f'Dimensions are {", ".join(DIMENSIONS)}.')
+        if columns == rows:
+            raise ValueError('Rows and columns must be different dimensions.')
+        if measure not in MEASURES:
+            raise ValueError(f'Measures are {", ".join(MEASURES)}.')
+
+        data = self.columns
+        mask = np.ones(len(data['order_id']), dtype=bool)
+        if start:
+            mask &= data['day'] >= np.datetime64(start, 'D')
+        if end:
+            mask &= data['day'] <= np.datetime64(end, 'D')
+        for dimension, value in (filters or {}).items():
+            if dimension not in CATEGORICAL:
+                raise ValueError(f'Filters are {", ".join(CATEGORICAL)}.')
+            code = self.dictionaries[dimension].codes.get(value)
+            mask &= data[dimension] == (-1 if code is None else code)
+
+        weights = self._measure(measure, data, mask)
+        groups = [self._codes(dimension, data, mask) for dimension in [rows] + ([columns] if columns else [])]
+        shape = tuple(len(keys) for _, keys in groups)
+        flat = groups[0][0] if not columns else groups[0][0] * shape[1] + groups[1][0]
+        size = int(np.prod(shape))
+        totals = np.bincount(flat, weights=weights, minlength=size).reshape(shape)
+        counts = np.bincount(flat, minlength=size).reshape(shape)
+
+        # only groups that have lines, biggest first for categorical dimensions
+        row_counts = counts.sum(axis=1) if columns else counts
+        row_totals = totals.sum(axis=1) if columns else totals
+        row_order = np.flatnonzero(row_counts)
+        if rows in CATEGORICAL:
+            row_order = row_order[np.argsort(-row_totals[row_order], kind='stable')][:limit]
+        result = {
+            'measure': measure,
+            'rows': {'dimension': rows, 'labels': self._labels(rows, groups[0][1][row_order])},
+            'row_totals': _rounded(row_totals[row_order]),
+            'total': round(float(totals.sum()), 2),
+            'lines': int(mask.sum()),
+            'as_of_order': self.last_order_id,
+        }
+        if columns:
+            column_totals = totals.sum(axis=0)
+            column_order = np.flatnonzero(counts.sum(axis=0))
+            if columns in CATEGORICAL:
+                column_order = column_order[np.argsort(-column_totals[column_order], kind='stable')]
+            column_order = column_order[:MAX_COLUMNS]
+            result['columns'] = {'dimension': columns, 'labels': self._labels(columns, groups[1][1][column_order])}
+            result['values'] = [_rounded(row) for row in totals[np.ix_(row_order, column_order)]]
+        else:
+            result['columns'] = None
+            result['values'] = result['row_totals']
+        return result
+
+
+def _rounded(values):
+    return [round(float(value), 2) for value in values]
+
+
+_lock = threading.Lock()
+_cube = None
+
+
+def current_cube():
+    """This process's SalesCube, topped up with any new orders"""
+    global _cube
+    with _lock:
+        if _cube is None:
+            _cube = SalesCube()
+        _cube.refresh()
+        return _cube
+
+
+def parse_filter(dimension, value):
+    """Query-string value of a filter: an id for id-keyed dimensions, the name otherwise"""
+    if dimension in ID_LABELS:
+        if not str(value).isdigit():
+            raise ValueError(f'The {dimension} filter takes an id.')
+        return int(value)
+    return value
+
@@ -0,0 +1,235 @@
+"""
+POS catalog sync.
+
+Terminals keep a local copy of the sellable variants instead of getting the
+whole catalog rendered into pos.html. The catalog version is the newest
+variant ``updated_at`` / tombstone ``deleted_at``, encoded as microseconds
+since the epoch, and doubles as the sync cursor and the ETag.
+"""
+import bisect
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Max
+
+from .models import ProductVariant, CatalogTombstone
+
+# column order of the compact rows sent to terminals
+CATALOG_FIELDS = ['id', 'sku', 'name', 'color', 'size', 'price', 'stock', 'image']
+
+# rows saved just before a cursor was handed out may commit a little later,
+# so deltas look back a few seconds; re-sending a row is harmless
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+def encode_cursor(moment):
+    if moment is None:
+        return '0'
+    return str(int(moment.timestamp() * 1_000_000))
+
+
+def decode_cursor(value):
+    """Returns an aware datetime for a cursor string, or None if it is missing/invalid"""
+    try:
+        micros = int(value)
+    except (TypeError, ValueError):
+        return None
+    if micros <= 0:
+        return None
+    try:
+        return datetime(1970, 1, 1, tzinfo=dt_timezone.utc) + timedelta(microseconds=micros)
+    except OverflowError:  # past datetime.max
+        return None
+
+
+def catalog_version():
+    """Current catalog cursor, cheap thanks to the indexes on updated_at/deleted_at"""
+    newest_variant = ProductVariant.objects.aggregate(m=Max('updated_at'))['m']
+    newest_tombstone = CatalogTombstone.objects.aggregate(m=Max('deleted_at'))['m']
+    moments = [m for m in (newest_variant, newest_tombstone) if m is not None]
+    return encode_cursor(max(moments) if moments else None)
+
+
+def variant_row(variant):
+    product = variant.product
+    return [
+        variant.id,
+        variant.sku,
+        f"{product.brand} {product.name}",
+        variant.color,
+        variant.size,
+        float(variant.retail_price),
+        variant.initial_quantity,
+        product.image.url if product.image else '',
+    ]
+
+
+def catalog_payload(since=None):
+    """
+    Full snapshot when ``since`` is None, otherwise only the variants changed
+    and the SKUs deleted after that moment.
+    """
+    version = catalog_version()
+    variants = ProductVariant.objects.select_related('product').order_by('id')
+    deleted = []
+    if since is not None:
+        window_start = since - SYNC_OVERLAP
+        variants = variants.filter(updated_at__gt=window_start)
+        deleted = list(
+            CatalogTombstone.objects.filter(deleted_at__gt=window_start)
+            .values_list('variant_id', flat=True)
+        )
+    return {
+        'version': version,
+        'full': since is None,
+        'fields': CATALOG_FIELDS,
+        'rows': [variant_row(v) for v in variants.iterator(chunk_size=2000)],
+        'deleted': deleted,
+    }
+
+
+class VariantPrefixIndex:
+    """
+    In-memory prefix index for POS typeahead.
+
+    SKUs are kept in one sorted list of ``(key, variant_id)`` pairs and
+    brand / name / "brand name" in another keyed by product, so a lookup is
+    a bisect plus a short scan. The index remembers the catalog cursor it
+    was built at and patches itself from the catalog delta when the cursor
+    moves, which also picks up edits made by other worker processes.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.cursor = None
+        self.sku_keys = []
+        self.product_keys = []
+        self.variant_info = {}         # variant_id -> (sku_key, product_id)
+        self.product_info = {}         # product_id -> tuple of keys
+        self.product_variants = {}     # product_id -> set of variant ids
+
+    @staticmethod
+    def _product_keys(brand, name):
+        brand, name = brand.lower(), name.lower()
+        return tuple(sorted({brand, name, f"{brand} {name}"}))
+
+    def _remove_pair(self, keys, pair):
+        pos = bisect.bisect_left(keys, pair)
+        if pos < len(keys) and keys[pos] == pair:
+            del keys[pos]
+
+    def _remove_variant(self, variant_id):
+        info = self.variant_info.pop(variant_id, None)
+        if info is None:
+            return
+        sku_key, product_id = info
+        self._remove_pair(self.sku_keys, (sku_key, variant_id))
+        self.product_variants.get(product_id, set()).discard(variant_id)
+
+    def _set_product(self, product):
+        keys = self._product_keys(product.brand, product.name)
+        old = self.product_info.get(product.id)
+        if old == keys:
+            return
+        for key in old or ():
+            self._remove_pair(self.product_keys, (key, product.id))
+        for key in keys:
+            bisect.insort(self.product_keys, (key, product.id))
+        self.product_info[product.id] = keys
+
+    def _rebuild(self):
+        self.sku_keys = []
+        self.product_keys = []
+        self.variant_info = {}
+        self.product_info = {}
+        self.product_variants = {}
+        rows = ProductVariant.objects.values_list(
+            'id', 'sku', 'product_id', 'product__brand', 'product__name'
+        )
+        for variant_id, sku, product_id, brand, name in rows.iterator(chunk_size=5000):
+            sku_key = sku.lower()
+            self.sku_keys.append((sku_key, variant_id))
+            self.variant_info[variant_id] = (sku_key, product_id)
+            self.product_variants.setdefault(product_id, set()).add(variant_id)
+            if product_id not in self.product_info:
+                keys = self._product_keys(brand, name)
+                self.product_info[product_id] = keys
+                self.product_keys.extend((key, product_id) for key in keys)
+        self.sku_keys.sort()
+        self.product_keys.sort()
+
+    def _apply_delta(self, since):
+        window_start = since - SYNC_OVERLAP
+        deleted = CatalogTombstone.objects.filter(deleted_at__gt=window_start).values_list('variant_id', flat=True)
+        for variant_id in deleted:
+            self._remove_variant(variant_id)
+        changed = ProductVariant.objects.filter(updated_at__gt=window_start).select_related('product')
+        for variant in changed:
+            self._remove_variant(variant.id)
+            sku_key = variant.sku.lower()
+            bisect.insort(self.sku_keys, (sku_key, variant.id))
+            self.variant_info[variant.id] = (sku_key, variant.product_id)
+            self.product_variants.setdefault(variant.product_id, set()).add(variant.id)
+            self._set_product(variant.product)
+
+    def refresh(self):
+        version = catalog_version()
+        if version == self.version:
+            return
+        with self._lock:
+            if version == self.version:
+                return
+            if self.cursor is None:
+                self._rebuild()
+            else:
+                self._apply_delta(self.cursor)
+            self.version = version
+            self.cursor = decode_cursor(version)
+
+    def _scan(self, keys, prefix):
+        pos = bisect.bisect_left(keys, (prefix,))
+        while pos < len(keys) and keys[pos][0].startswith(prefix):
+            yield keys[pos][1]
+            pos += 1
+
+    def lookup(self, query, limit=20):
+        """Variant ids whose SKU, brand or name starts with ``query``; SKU hits first"""
+        prefix = query.strip().lower()
+        if not prefix:
+            return []
+        self.refresh()
+        # refresh() edits the lists in place, so scans hold the same lock
+        with self._lock:
+            return self._find(prefix, limit)
+
+    def _find(self, prefix, limit):
+        found = []
+        seen = set()
+        for variant_id in self._scan(self.sku_keys, prefix):
+            if variant_id not in seen:
+                seen.add(variant_id)
+                found.append(variant_id)
+                if len(found) >= limit:
+                    return found
+        for product_id in self._scan(self.product_keys, prefix):
+            for variant_id in sorted(self.product_variants.get(product_id, ())):
+                if variant_id not in seen:
+                    seen.add(variant_id)
+                    found.append(variant_id)
+                    if len(found) >= limit:
+                        return found
+        return found
+
+
+variant_index = VariantPrefixIndex()
+
+
+def search_variants(query, limit=20):
+    """Top ``limit`` variants for a typeahead query, with live price/stock"""
+    ids = variant_index.lookup(query, limit=limit)
+    variants = ProductVariant.objects.select_related('product').in_bulk(ids)
+    return [
+        dict(zip(CATALOG_FIELDS, variant_row(variants[variant_id])))
+        for variant_id in ids
+        if variant_id in variants
+    ]
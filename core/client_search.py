@@ -0,0 +1,79 @@
+"""
+Client lookup for the till and the client list.
+
+Each client carries a few normalized copies of its contact details (see
+``search_keys``): phone digits reversed, lowercase first/last name and the
+lowercase email local part, all indexed. Every search is then a prefix
+match, written as a ``>= prefix`` / ``< prefix-upper-bound`` range so a
+plain B-tree index serves it on any backend. "Last 4 digits of the phone"
+becomes a prefix of the reversed digits.
+"""
+import re
+
+from django.db.models import Q
+
+from .models import Client
+
+# a digits-only query shorter than this is too vague to match phones on
+MIN_PHONE_DIGITS = 3
+
+
+def search_keys(first_name, last_name, phone, email):
+    """The normalized search columns for a client's contact details"""
+    digits = re.sub(r'\D', '', phone or '')
+    return {
+        'phone_digits_rev': digits[::-1],
+        'first_name_key': (first_name or '').strip().lower(),
+        'last_name_key': (last_name or '').strip().lower(),
+        'email_key': (email or '').strip().lower().split('@')[0],
+    }
+
+
+def _prefix(field, prefix):
+    """Range filter equivalent to ``field LIKE 'prefix%'`` that can use the index"""
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': upper})
+
+
+def client_search_filter(query):
+    """Q object for a free-text client search, or None when there is nothing to search for"""
+    query = (query or '').strip().lower()
+    if not query:
+        return None
+    if not re.search(r'[a-z@]', query):
+        digits = re.sub(r'\D', '', query)
+        if len(digits) < MIN_PHONE_DIGITS:
+            return None
+        # typed digits are the end of the number, or the whole of it
+        return _prefix('phone_digits_rev', digits[::-1])
+    if '@' in query:
+        local = query.split('@')[0]
+        return _prefix('email_key', local) if local else None
+    tokens = query.split()
+    if len(tokens) == 1:
+        token = tokens[0]
+        return _prefix('first_name_key', token) | _prefix('last_name_key', token) | _prefix('email_key', token)
+    first, last = tokens[0], tokens[-1]
+    return (
+        (_prefix('first_name_key', first) & _prefix('last_name_key', last))
+        | (_prefix('first_name_key', last) & _prefix('last_name_key', first))
+    )
+
+
+def search_clients(query, queryset=None):
+    """Clients matching ``query``, or an empty queryset if it can't be searched"""
+    queryset = Client.objects.all() if queryset is None else queryset
+    condition = client_search_filter(query)
+    if condition is None:
+        return queryset.none()
+    return queryset.filter(condition)
+
+
+def client_row(client):
+    return {
+        'id': client.id,
+        'name': str(client),
+        'phone': client.phone,
+        'email': client.email or '',
+        'tier': client.dynamic_tier_label(),
+    }
@@ -0,0 +1,59 @@
+"""
+Dashboard fragment cache.
+
+The dashboard is split into fragments (KPIs, top products, low stock,
+active promotions, recent orders), each cached per role, day and location
+filter. Every fragment has a generation number in the cache that is part
+of its key; writes that change a fragment's data bump its generation,
+which orphans the old entries. FRAGMENT_TTL bounds staleness for anything that slips
+past the hooks (promotions starting on the clock, edits in the admin).
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+FRAGMENT_TTL = 60
+
+KPIS = 'kpis'
+TOP_PRODUCTS = 'top_products'
+LOW_STOCK = 'low_stock'
+PROMOTIONS = 'promotions'
+RECENT_ORDERS = 'recent_orders'
+FRAGMENTS = (KPIS, TOP_PRODUCTS, LOW_STOCK, PROMOTIONS, RECENT_ORDERS)
+
+# what a sale, exchange or return touches
+SALE_FRAGMENTS = (KPIS, TOP_PRODUCTS, LOW_STOCK, RECENT_ORDERS)
+
+
+def _generation_key(fragment):
+    return f'dashboard:gen:{fragment}'
+
+
+class DashboardFragments:
+    """Cached fragment lookups for one dashboard render, for a location id or the whole chain"""
+    def __init__(self, role, day, location_id=None):
+        self.role = role
+        self.day = day.isoformat()
+        self.scope = location_id or 'all'
+        keys = {_generation_key(fragment): fragment for fragment in FRAGMENTS}
+        stored = cache.get_many(keys)
+        self.generations = {fragment: stored.get(key, 0) for key, fragment in keys.items()}
+
+    def get(self, fragment, compute):
+        key = f'dashboard:{fragment}:{self.role}:{self.day}:{self.scope}:{self.generations[fragment]}'
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            cache.set(key, value, FRAGMENT_TTL)
+        return value
+
+
+def invalidate_dashboard(*fragments):
+    generation = time.time_ns()
+    cache.set_many({_generation_key(fragment): generation for fragment in fragments or FRAGMENTS}, None)
+
+
+def dashboard_changed(*fragments):
+    """Invalidates once the surrounding transaction commits, so readers can't re-cache old data"""
+    transaction.on_commit(lambda: invalidate_dashboard(*fragments))
@@ -0,0 +1,69 @@
+"""
+In-process event fan-out for live dashboards.
+
+Each open dashboard holds a Subscription: an asyncio queue on the event
+loop serving its SSE response. Checkout and return code runs in worker
+threads, so publish() hands events to each subscriber's loop with
+call_soon_threadsafe. Events only reach dashboards connected to the same
+process; a dashboard on another worker still catches up on its next load.
+"""
+import asyncio
+import json
+import threading
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+# events a slow dashboard may fall behind by before the oldest are dropped
+QUEUE_SIZE = 100
+
+_subscribers = set()
+_lock = threading.Lock()
+
+
+class Subscription:
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def deliver(self, event):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def next(self, timeout):
+        """The next (kind, json) event, or None if nothing arrived within ``timeout`` seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+def subscribe():
+    """Must be called from the event loop that will read the subscription"""
+    subscription = Subscription()
+    with _lock:
+        _subscribers.add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription):
+    with _lock:
+        _subscribers.discard(subscription)
+
+
+def publish(kind, data):
+    event = (kind, json.dumps(data, cls=DjangoJSONEncoder))
+    with _lock:
+        subscribers = list(_subscribers)
+    for subscription in subscribers:
+        try:
+            subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+        except RuntimeError:
+            # its loop has shut down
+            unsubscribe(subscription)
+
+
+def publish_on_commit(kind, data):
+    """Publishes once the surrounding transaction commits, so dashboards never see rolled-back sales"""
+    transaction.on_commit(lambda: publish(kind, data))
@@ -0,0 +1,163 @@
+"""
+Report exports.
+
+Order rows come from one annotated values() query read with a server-side
+iterator, so an export holds a chunk of rows in memory whatever the period.
+CSV and NDJSON are generated as the response streams; the Excel workbook is
+written with openpyxl's write-only mode, which spools rows to disk as they
+are appended, into a temporary file that is then streamed back.
+"""
+import csv
+import json
+import tempfile
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Order
+from .reports import product_sales
+from .rollups import SOLD_STATUSES, SOLD_TYPES
+
+EXPORT_CHUNK = 2000
+# longer Excel exports are generated by the background worker
+INLINE_EXPORT_DAYS = 92
+TOP_PRODUCTS = 20
+
+ORDER_COLUMNS = ('Order Code', 'Date', 'Location', 'Type', 'Status', 'Client', 'Items', 'Total', 'Cashier')
+ORDER_FIELDS = ('order_code', 'date', 'location', 'type', 'status', 'client', 'items', 'total', 'cashier')
+# position of the Total column, written as a number in the workbook
+TOTAL_COLUMN = ORDER_FIELDS.index('total')
+
+CONTENT_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def file_stem(period, location=None):
+    """Download name without extension, e.g. aurelion_report_MAIN_20260101_20260131"""
+    scope = f'{location.code}_' if location else ''
+    return f'aurelion_report_{scope}{period.start:%Y%m%d}_{period.end:%Y%m%d}'
+
+
+def order_rows(period, location=None, chunk_size=EXPORT_CHUNK):
+    """One tuple per order sold in the period (ORDER_COLUMNS order), newest first"""
+    start, end = period.bounds()
+    orders = Order.objects.filter(status__in=SOLD_STATUSES, type__in=SOLD_TYPES,
+                                  created_at__gte=start, created_at__lt=end)
+    if location:
+        orders = orders.filter(location=location)
+    orders = (
+        orders.annotate(item_count=Count('items'))
+        .values_list('order_code', 'id', 'created_at', 'location__name', 'type', 'status',
+                     'client__first_name', 'client__last_name', 'item_count',
+                     'total_amount', 'created_by__username')
+        .order_by('-created_at', '-id')
+    )
+    for code, order_id, created_at, location_name, type_, status, first_name, last_name, items, total, cashier in orders.iterator(chunk_size=chunk_size):
+        client = f"{first_name or ''} {last_name or ''}".strip() if first_name is not None else 'Walk-in'
+        yield (
+            code or str(order_id),
+            timezone.localtime(created_at).strftime('%Y-%m-%d %H:%M'),
+            location_name or '', type_, status, client, items, total, cashier or '',
+        )
+
+
+class _Echo:
+    """File-like object whose write() hands the line back to csv.writer's caller"""
+    def write(self, value):
+        return value
+
+
+def csv_stream(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(ORDER_COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_stream(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(ORDER_FIELDS, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def write_workbook(target, period, report, progress=None):
+    """
+    Writes the Excel report (summary, orders, top products and, for the
+    whole chain, locations) to ``target``, a path or binary file, scoped to
+    report['location']. ``progress(done, total)`` is called every
+    EXPORT_CHUNK orders. Raises ImportError when openpyxl isn't installed.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    wb = Workbook(write_only=True)
+    header_font = Font(bold=True, size=14)
+
+    def header(ws, *titles):
+        cells = []
+        for title in titles:
+            cell = WriteOnlyCell(ws, value=title)
+            cell.font = header_font
+            cells.append(cell)
+        return cells
+
+    ws = wb.create_sheet("Summary")
+    ws.column_dimensions['A'].width = 25
+    ws.column_dimensions['B'].width = 20
+    location = report['location']
+    scope = f"{location.name}, " if location else ""
+    title = WriteOnlyCell(ws, value=f"AURELION Sales Report ({scope}{period.start:%b %d, %Y} - {period.end:%b %d, %Y})")
+    title.font = Font(bold=True, size=18)
+    ws.append([title])
+    ws.append([])
+    ws.append(header(ws, "Metric", "Value"))
+    for metric, value in [
+        ("Total Revenue", f"${report['total_revenue']:,.2f}"),
+        ("Refunds", f"${report['total_refunds']:,.2f}"),
+        ("Net Revenue", f"${report['net_revenue']:,.2f}"),
+        ("Total Cost", f"${report['total_cost']:,.2f}"),
+        ("Total Profit", f"${report['total_profit']:,.2f}"),
+        ("Profit Margin", f"{report['profit_margin']:.1f}%"),
+        ("Total Orders", str(report['total_orders'])),
+        ("Total Items Sold", str(report['total_items'])),
+        ("Average Order Value", f"${report['avg_order_value']:,.2f}"),
+        ("Figures As Of", timezone.localtime(report['computed_at']).strftime('%Y-%m-%d %H:%M')),
+    ]:
+        ws.append([metric, value])
+
+    ws = wb.create_sheet("Orders")
+    ws.append(header(ws, *ORDER_COLUMNS))
+    for written, row in enumerate(order_rows(period, location), start=1):
+        ws.append(row[:TOTAL_COLUMN] + (float(row[TOTAL_COLUMN]),) + row[TOTAL_COLUMN + 1:])
+        if progress and written % EXPORT_CHUNK == 0:
+            progress(written, report['total_orders'])
+
+    ws = wb.create_sheet("Top Products")
+    ws.append(header(ws, 'Product', 'Brand', 'Qty Sold', 'Revenue'))
+    for item in product_sales(period, location).order_by('-total_revenue')[:TOP_PRODUCTS]:
+        ws.append([item['product__name'], item['brand'], item['total_qty'], float(item['total_revenue'])])
+
+    if not location:
+        ws = wb.create_sheet("Locations")
+        ws.append(header(ws, 'Location', 'Orders', 'Revenue', 'Refunds', 'Net Revenue'))
+        for row in report['location_sales']:
+            ws.append([row['location__name'], row['orders'], float(row['revenue'] or 0),
+                       float(row['refunds'] or 0), float(row['net_revenue'] or 0)])
+
+    wb.save(target)
+
+
+def workbook_file(period, report):
+    """The Excel report in an anonymous temporary file, rewound for reading"""
+    handle = tempfile.TemporaryFile()
+    try:
+        write_workbook(handle, period, report)
+    except BaseException:
+        handle.close()
+        raise
+    handle.seek(0)
+    return handle
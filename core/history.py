@@ -0,0 +1,83 @@
+"""
+Client purchase history.
+
+Orders are paged newest first with a keyset cursor on (created_at, id), so
+each page is one index range read on (client, created_at, id) plus one
+prefetch for its lines, however long the client's history is. Lifetime
+figures come from a single aggregate.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, Max, Min, Prefetch, Q, Sum
+
+from .catalog import decode_cursor, encode_cursor
+from .models import Order, OrderItem
+
+HISTORY_PAGE_SIZE = 25
+# largest primary key the database can store; bigger cursor ids are invalid
+MAX_ORDER_ID = 2 ** 63 - 1
+
+
+def encode_history_cursor(order):
+    return f"{encode_cursor(order.created_at)}.{order.id}"
+
+
+def decode_history_cursor(value):
+    """(created_at, id) for a cursor string, or None if it is missing/invalid"""
+    moment, _, order_id = (value or '').partition('.')
+    moment = decode_cursor(moment)
+    if moment is None or not order_id.isdigit() or int(order_id) > MAX_ORDER_ID:
+        return None
+    return moment, int(order_id)
+
+
+def purchase_history(client, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """One page of the client's orders, newest first. Returns (orders, next_cursor)."""
+    orders = (
+        Order.objects.filter(client=client)
+        .select_related('location')
+        .prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('variant__product')))
+        .order_by('-created_at', '-id')
+    )
+    position = decode_history_cursor(cursor)
+    if position is not None:
+        created_at, order_id = position
+        orders = orders.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=order_id))
+    # one extra row tells us whether there is a next page
+    page = list(orders[:limit + 1])
+    next_cursor = encode_history_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
+
+
+def lifetime_totals(client):
+    completed = Q(status=Order.Status.COMPLETED)
+    totals = Order.objects.filter(client=client).aggregate(
+        orders=Count('id'),
+        completed_orders=Count('id', filter=completed),
+        completed_spend=Sum('total_amount', filter=completed),
+        first_order=Min('created_at'),
+        last_order=Max('created_at'),
+    )
+    totals['completed_spend'] = totals['completed_spend'] or Decimal('0.00')
+    return totals
+
+
+def history_row(order):
+    return {
+        'id': order.id,
+        'order_code': order.order_code or str(order.id),
+        'created_at': order.created_at.isoformat(),
+        'status': order.ui_status,
+        'status_display': order.get_status_display(),
+        'location': order.location.code,
+        'total': float(order.total_amount),
+        'items': [
+            {
+                'sku': item.variant.sku,
+                'name': item.variant.product.name,
+                'quantity': item.quantity,
+                'unit_price': float(item.unit_price),
+            }
+            for item in order.items.all()
+        ],
+    }
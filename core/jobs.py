@@ -0,0 +1,124 @@
+"""
+Background jobs.
+
+Views queue slow work (big exports, label PDFs) as BackgroundJob rows and
+``manage.py run_jobs`` picks them up, so a request never holds a gunicorn
+worker for the length of the job. There is no broker: a worker claims the
+oldest queued job with a conditional UPDATE, which only one worker can win,
+writes the result under settings.JOB_FILES_DIR and records progress on the
+row for the status endpoint to poll.
+"""
+import logging
+import os
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import exports, reports
+from .labels import label_variants, write_labels_pdf
+from .models import BackgroundJob, Location
+
+logger = logging.getLogger(__name__)
+
+# a RUNNING job older than this belongs to a worker that died
+JOB_TIMEOUT = timedelta(hours=1)
+# finished jobs and their files are kept this long
+JOB_RETENTION = timedelta(days=2)
+# progress is written at most this often
+PROGRESS_INTERVAL = 1.0
+
+
+def _report_export(job, path, progress):
+    period = reports.ReportPeriod(date.fromisoformat(job.params['start']), date.fromisoformat(job.params['end']))
+    location = Location.objects.get(pk=job.params['location']) if job.params.get('location') else None
+    exports.write_workbook(path, period, reports.cached_report(period, location), progress)
+    return f'{exports.file_stem(period, location)}.xlsx', exports.CONTENT_TYPES['xlsx']
+
+
+def _barcode_pdf(job, path, progress):
+    labels = label_variants(job.params['variants'], job.params.get('barcode_mode', 'single'))
+    write_labels_pdf(path, labels, progress)
+    return 'barcodes.pdf', 'application/pdf'
+
+
+# kind -> handler(job, path, progress) writing the file to path and
+# returning (download file name, content type)
+HANDLERS = {
+    BackgroundJob.Kind.REPORT_EXPORT: _report_export,
+    BackgroundJob.Kind.BARCODE_PDF: _barcode_pdf,
+}
+
+
+def enqueue(kind, params, user=None):
+    return BackgroundJob.objects.create(kind=kind, params=params, created_by=user)
+
+
+def job_path(job):
+    return os.path.join(settings.JOB_FILES_DIR, f'job-{job.id}')
+
+
+def claim_next():
+    """Marks the oldest queued job RUNNING and returns it, or None when the queue is empty"""
+    queued = (
+        BackgroundJob.objects.filter(status=BackgroundJob.Status.QUEUED)
+        .order_by('created_at', 'id').values_list('id', flat=True)
+    )
+    for job_id in queued[:10]:
+        claimed = BackgroundJob.objects.filter(id=job_id, status=BackgroundJob.Status.QUEUED).update(
+            status=BackgroundJob.Status.RUNNING, started_at=timezone.now(),
+        )
+        if claimed:
+            return BackgroundJob.objects.get(id=job_id)
+    return None
+
+
+def run_job(job):
+    """Runs a claimed job to completion, recording the result or the error on its row"""
+    jobs = BackgroundJob.objects.filter(id=job.id)
+    last_write = [0.0]
+
+    def progress(done, total):
+        now = time.monotonic()
+        if total and now - last_write[0] >= PROGRESS_INTERVAL:
+            last_write[0] = now
+            jobs.update(progress=min(99, done * 100 // total))
+
+    path = job_path(job)
+    os.makedirs(settings.JOB_FILES_DIR, exist_ok=True)
+    try:
+        file_name, content_type = HANDLERS[job.kind](job, path, progress)
+    except Exception as e:
+        logger.exception("Background job %s failed", job.id)
+        if os.path.exists(path):
+            os.remove(path)
+        jobs.update(status=BackgroundJob.Status.FAILED, message=str(e)[:255], finished_at=timezone.now())
+        return False
+    jobs.update(
+        status=BackgroundJob.Status.DONE, progress=100, file_name=file_name, file_path=path,
+        content_type=content_type, finished_at=timezone.now(),
+    )
+    return True
+
+
+def fail_stale():
+    """Fails RUNNING jobs whose worker stopped before finishing them"""
+    return BackgroundJob.objects.filter(
+        status=BackgroundJob.Status.RUNNING, started_at__lt=timezone.now() - JOB_TIMEOUT,
+    ).update(
+        status=BackgroundJob.Status.FAILED, message='The worker stopped before the job finished.',
+        finished_at=timezone.now(),
+    )
+
+
+def purge_expired():
+    """Deletes finished jobs older than JOB_RETENTION along with their files"""
+    expired = BackgroundJob.objects.filter(
+        status__in=[BackgroundJob.Status.DONE, BackgroundJob.Status.FAILED],
+        finished_at__lt=timezone.now() - JOB_RETENTION,
+    )
+    for path in expired.exclude(file_path='').values_list('file_path', flat=True):
+        if os.path.exists(path):
+            os.remove(path)
+    return expired.delete()[0]
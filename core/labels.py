@@ -0,0 +1,111 @@
+"""
+Barcode label sheets: A4 pages of Code 128 labels, three per row.
+"""
+import io
+
+from .models import ProductVariant
+
+# bigger runs are generated by the background worker (about five pages)
+INLINE_LABELS = 75
+
+
+def label_variants(variant_ids, barcode_mode='single'):
+    """
+    The variants to print, in order: one label each, or in 'quantity' mode
+    one per unit of initial stock.
+    """
+    variants = ProductVariant.objects.filter(id__in=variant_ids).select_related('product')
+    labels = []
+    for variant in variants:
+        if barcode_mode == 'quantity':
+            labels.extend([variant] * max(1, variant.initial_quantity))
+        else:
+            labels.append(variant)
+    return labels
+
+
+def write_labels_pdf(target, labels, progress=None):
+    """
+    Draws a label for each variant in ``labels`` into ``target`` (a path or
+    binary file). ``progress(done, total)`` is called after every page.
+    Raises ImportError when reportlab or python-barcode isn't installed.
+    """
+    import barcode
+    from barcode.writer import ImageWriter
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    p = canvas.Canvas(target, pagesize=A4)
+    width, height = A4
+
+    barcode_width = 60 * mm
+    barcode_height = 25 * mm
+    label_height = 40 * mm
+    margin_x = 15 * mm
+    margin_y = 15 * mm
+    spacing_x = 5 * mm
+    spacing_y = 8 * mm
+
+    cols = 3
+    col = 0
+    row = 0
+    max_rows = int((height - 2 * margin_y) / (label_height + spacing_y))
+    CODE128 = barcode.get_barcode_class('code128')
+
+    def draw_barcode(p, variant, x, y):
+        """Helper function to draw a single barcode"""
+        try:
+            code = CODE128(variant.sku, writer=ImageWriter())
+            barcode_buffer = io.BytesIO()
+            code.write(barcode_buffer, options={
+                'module_width': 0.3,
+                'module_height': 8,
+                'font_size': 0,
+                'text_distance': 1,
+                'quiet_zone': 2,
+            })
+            barcode_buffer.seek(0)
+            barcode_img = ImageReader(barcode_buffer)
+
+            product_name = f"{variant.product.brand} {variant.product.name}"
+            if len(product_name) > 28:
+                product_name = product_name[:25] + "..."
+
+            p.setFont("Helvetica-Bold", 8)
+            p.drawString(x, y + label_height - 8, product_name)
+
+            variant_info = f"{variant.color or ''} / {variant.size or ''}"
+            p.setFont("Helvetica", 7)
+            p.drawString(x, y + label_height - 18, variant_info.strip(' /'))
+
+            p.drawImage(barcode_img, x, y + 8, width=barcode_width, height=barcode_height - 5, preserveAspectRatio=True)
+
+            p.setFont("Helvetica", 8)
+            p.drawCentredString(x + barcode_width / 2, y, variant.sku)
+
+        except Exception:
+            p.setFont("Helvetica-Bold", 9)
+            product_display = f"{variant.product.brand} {variant.product.name}"[:30]
+            p.drawString(x, y + 20, product_display)
+            p.setFont("Helvetica", 8)
+            p.drawString(x, y + 8, f"SKU: {variant.sku}")
+
+    for done, variant in enumerate(labels, start=1):
+        x = margin_x + col * (barcode_width + spacing_x)
+        y = height - margin_y - (row + 1) * (label_height + spacing_y)
+
+        draw_barcode(p, variant, x, y)
+
+        col += 1
+        if col >= cols:
+            col = 0
+            row += 1
+            if row >= max_rows:
+                p.showPage()
+                row = 0
+                if progress:
+                    progress(done, len(labels))
+
+    p.save()
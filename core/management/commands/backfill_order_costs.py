@@ -0,0 +1,32 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import DecimalField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from core.models import OrderItem, ProductVariant
+
+
+class Command(BaseCommand):
+    help = "Fills OrderItem.unit_cost on lines sold before costs were captured, from the variant's current cost price"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        cost = Coalesce(
+            Subquery(ProductVariant.objects.filter(pk=OuterRef('variant_id')).values('cost_price')[:1]),
+            Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        )
+        filled = 0
+        while True:
+            ids = list(OrderItem.objects.filter(unit_cost__isnull=True).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            filled += OrderItem.objects.filter(id__in=ids).update(unit_cost=cost)
+            self.stdout.write(f"  {filled} lines filled")
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfilled unit_cost on {filled} order lines; run rebuild_rollups to refresh sales cost"
+        ))
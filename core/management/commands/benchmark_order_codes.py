@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.order_codes import order_code_for, CODE_SPACE
+
+
+class Command(BaseCommand):
+    help = "Times order code allocation at increasing order counts and checks the codes are unique"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1_000_000, help='codes generated per sample')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        self.stdout.write(f"{'starting id':>16} {'codes':>10} {'ns/code':>10} {'unique':>8}")
+        for start in (1, 1_000_000, 10_000_000, 1_000_000_000, CODE_SPACE - count):
+            began = time.perf_counter()
+            codes = {order_code_for(order_id) for order_id in range(start, start + count)}
+            elapsed = time.perf_counter() - began
+            self.stdout.write(
+                f"{start:>16,} {count:>10,} {elapsed / count * 1e9:>10.0f} {str(len(codes) == count):>8}"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            "Allocation is pure arithmetic on the order id: no reads, no retries, same cost at any volume."
+        ))
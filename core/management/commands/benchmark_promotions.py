@@ -0,0 +1,79 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import Product, Promotion
+from core.promotions import CompiledPromotion, PromoLine, PromotionSet
+
+
+class Command(BaseCommand):
+    help = "Compares scanning every promotion per cart with the indexed PromotionSet lookup (in memory, no DB writes)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--promotions', type=int, default=500)
+        parser.add_argument('--lines', type=int, default=50)
+        parser.add_argument('--carts', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def _promotions(self, count, rng, now):
+        brands = [b for b, _ in Product.BRAND_CHOICES]
+        categories = [c for c, _ in Product.CATEGORY_CHOICES]
+        promotions = []
+        for i in range(count):
+            applies_to = rng.choice([Promotion.AppliesTo.BRAND, Promotion.AppliesTo.CATEGORY,
+                                     Promotion.AppliesTo.PRODUCTS, Promotion.AppliesTo.PRODUCTS])
+            promo = Promotion(
+                id=i + 1, name=f'Promo {i}', promo_type=rng.choice(
+                    [Promotion.Type.PERCENTAGE, Promotion.Type.FIXED, Promotion.Type.BOGO]),
+                discount_value=Decimal(rng.randint(5, 40)), applies_to=applies_to,
+                brand=rng.choice(brands), category=rng.choice(categories),
+                start_date=now - timedelta(days=1), end_date=now + timedelta(days=1),
+            )
+            product_ids = rng.sample(range(1, 20_001), 20) if applies_to == Promotion.AppliesTo.PRODUCTS else ()
+            promotions.append(CompiledPromotion(promo, product_ids))
+        return promotions
+
+    def _cart(self, lines, rng):
+        brands = [b for b, _ in Product.BRAND_CHOICES]
+        categories = [c for c, _ in Product.CATEGORY_CHOICES]
+        return [
+            PromoLine(rng.randint(1, 20_000), rng.choice(brands), rng.choice(categories),
+                      Decimal(rng.randint(50, 5000)), rng.randint(1, 3))
+            for _ in range(lines)
+        ]
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        promotions = self._promotions(options['promotions'], rng, now)
+        promotion_set = PromotionSet(promotions, now)
+        carts = [self._cart(options['lines'], rng) for _ in range(options['carts'])]
+
+        began = time.perf_counter()
+        scanned = []
+        for cart in carts:
+            best = Decimal('0.00')
+            for promo in promotion_set.automatic:
+                amount, _ = promo.calculate(cart, None, now)
+                best = max(best, amount)
+            scanned.append(best)
+        scan_time = time.perf_counter() - began
+
+        began = time.perf_counter()
+        indexed = [promotion_set.best_for(cart, now=now)[1] for cart in carts]
+        index_time = time.perf_counter() - began
+
+        per_cart = 1000 / len(carts)
+        self.stdout.write(
+            f"{options['promotions']} promotions, {options['lines']}-line carts, {len(carts)} carts"
+        )
+        self.stdout.write(f"  scan every promotion: {scan_time * per_cart:8.3f} ms/cart")
+        self.stdout.write(f"  indexed lookup:       {index_time * per_cart:8.3f} ms/cart")
+        if scanned == indexed:
+            self.stdout.write(self.style.SUCCESS("  same discount for every cart"))
+        else:
+            self.stdout.write(self.style.ERROR("  results differ"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.models import ClientStats
+
+
+class Command(BaseCommand):
+    help = "Recomputes every client's visit count and lifetime spend from completed orders"
+
+    def handle(self, *args, **options):
+        count = ClientStats.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {count} clients"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core import rollups
+
+
+class Command(BaseCommand):
+    help = "Recomputes the daily product and hourly sales rollups from orders and returns"
+
+    def handle(self, *args, **options):
+        daily, hourly = rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {daily} daily product rows and {hourly} hourly rows"))
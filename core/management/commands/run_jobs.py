@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import jobs
+
+
+class Command(BaseCommand):
+    help = "Runs queued background jobs (report exports, label PDFs); keeps polling unless --once is given"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+        parser.add_argument('--poll', type=float, default=2.0, help="Seconds to sleep when the queue is empty")
+
+    def handle(self, *args, **options):
+        while True:
+            job = jobs.claim_next()
+            if job is None:
+                stale = jobs.fail_stale()
+                purged = jobs.purge_expired()
+                if stale or purged:
+                    self.stdout.write(f"Failed {stale} stale jobs, purged {purged} expired jobs")
+                if options['once']:
+                    return
+                time.sleep(options['poll'])
+                continue
+            self.stdout.write(f"Running {job}")
+            if jobs.run_job(job):
+                self.stdout.write(self.style.SUCCESS(f"Finished job {job.id}"))
+            else:
+                self.stdout.write(self.style.ERROR(f"Job {job.id} failed"))
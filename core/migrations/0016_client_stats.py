@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_checkout_idempotency_key'),
+    ]
+
+    def backfill_stats(apps, schema_editor):
+        Order = apps.get_model('core', 'Order')
+        ClientStats = apps.get_model('core', 'ClientStats')
+        totals = (
+            Order.objects.filter(status='COMPLETED', client__isnull=False)
+            .values('client_id')
+            .annotate(visits=models.Count('id'), spend=models.Sum('total_amount'))
+        )
+        ClientStats.objects.bulk_create([
+            ClientStats(client_id=row['client_id'], visit_count=row['visits'], lifetime_spend=row['spend'] or 0)
+            for row in totals
+        ], batch_size=1000)
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientStats',
+            fields=[
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='core.client')),
+                ('visit_count', models.IntegerField(default=0)),
+                ('lifetime_spend', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:45
+
+import re
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_client_stats'),
+    ]
+
+    def fill_search_keys(apps, schema_editor):
+        # a frozen copy of client_search.search_keys as of this migration
+        Client = apps.get_model('core', 'Client')
+        clients = list(Client.objects.all())
+        for client in clients:
+            client.phone_digits_rev = re.sub(r'\D', '', client.phone or '')[::-1]
+            client.first_name_key = (client.first_name or '').strip().lower()
+            client.last_name_key = (client.last_name or '').strip().lower()
+            client.email_key = (client.email or '').strip().lower().split('@')[0]
+        Client.objects.bulk_update(
+            clients, ['phone_digits_rev', 'first_name_key', 'last_name_key', 'email_key'], batch_size=1000
+        )
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='email_key',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='first_name_key',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='last_name_key',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='phone_digits_rev',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=20),
+        ),
+        migrations.RunPython(fill_search_keys, migrations.RunPython.noop),
+    ]
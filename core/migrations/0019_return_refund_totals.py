@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:48
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_order_client_history_index'),
+    ]
+
+    def backfill_refund_totals(apps, schema_editor):
+        OrderItem = apps.get_model('core', 'OrderItem')
+        ReturnItem = apps.get_model('core', 'ReturnItem')
+        Return = apps.get_model('core', 'Return')
+        line = OrderItem.objects.filter(pk=OuterRef('order_item_id'))
+        ReturnItem.objects.update(
+            unit_price=Subquery(line.values('unit_price')[:1]),
+            unit_cost=Coalesce(Subquery(line.values('variant__cost_price')[:1]), Value(0), output_field=DecimalField()),
+        )
+        items = ReturnItem.objects.filter(return_process=OuterRef('pk')).values('return_process')
+        money = DecimalField(max_digits=12, decimal_places=2)
+        Return.objects.update(
+            refund_amount=Coalesce(
+                Subquery(items.annotate(total=Sum(F('unit_price') * F('quantity'), output_field=money)).values('total')),
+                Value(0), output_field=money,
+            ),
+            refund_cost=Coalesce(
+                Subquery(items.annotate(total=Sum(F('unit_cost') * F('quantity'), output_field=money)).values('total')),
+                Value(0), output_field=money,
+            ),
+        )
+
+    operations = [
+        migrations.AddField(
+            model_name='return',
+            name='refund_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='return',
+            name='refund_cost',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='returnitem',
+            name='unit_cost',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='returnitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='return',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.RunPython(backfill_refund_totals, migrations.RunPython.noop),
+    ]
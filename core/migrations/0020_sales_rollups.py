@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_return_refund_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('brand', models.CharField(max_length=100)),
+                ('category', models.CharField(max_length=50)),
+                ('quantity', models.IntegerField(default=0)),
+                ('gross_sales', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('returned_quantity', models.IntegerField(default=0)),
+                ('refund_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('refund_cost', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.location')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'category'], name='daily_sales_category_idx'), models.Index(fields=['date', 'brand'], name='daily_sales_brand_idx')],
+                'unique_together': {('date', 'location', 'product')},
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('discounts', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('items_sold', models.IntegerField(default=0)),
+                ('exchange_orders', models.IntegerField(default=0)),
+                ('exchange_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('returns', models.IntegerField(default=0)),
+                ('refund_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('refund_cost', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.location')),
+            ],
+            options={
+                'unique_together': {('hour', 'location')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_background_jobs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dailyproductsales',
+            index=models.Index(fields=['location', 'date'], name='daily_sales_location_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hourlysales',
+            index=models.Index(fields=['location', 'hour'], name='hourly_sales_location_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['location', '-created_at'], name='order_location_recent_idx'),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
@@ -174,7 +174,7 @@ class ProductVariant(models.Model):
     minimum_stock_level = models.PositiveIntegerField(default=1)
     
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         unique_together = ('product', 'color', 'size')
@@ -187,6 +187,15 @@ class ProductVariant(models.Model):
         if self.retail_price and self.cost_price and self.retail_price < self.cost_price:
             raise ValidationError('Retail price cannot be lower than cost price.')
 
+class CatalogTombstone(models.Model):
+    """Remembers deleted variants so POS terminals can drop them on their next catalog sync"""
+    variant_id = models.BigIntegerField()
+    sku = models.CharField(max_length=50)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.sku} (deleted)"
+
 class Barcode(models.Model):
     class Type(models.TextChoices):
         EAN13 = 'EAN13', _('EAN-13')
@@ -247,6 +256,12 @@ class Client(models.Model):
     loyalty_tier = models.CharField(max_length=20, choices=LoyaltyTier.choices, default=LoyaltyTier.REGULAR, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # normalized copies for indexed prefix search, filled on save (see client_search)
+    phone_digits_rev = models.CharField(max_length=20, blank=True, default='', editable=False, db_index=True)
+    first_name_key = models.CharField(max_length=100, blank=True, default='', editable=False, db_index=True)
+    last_name_key = models.CharField(max_length=100, blank=True, default='', editable=False, db_index=True)
+    email_key = models.CharField(max_length=254, blank=True, default='', editable=False, db_index=True)
+
     def get_tier(self):
         """Returns manual tier if set, otherwise calculates dynamically."""
         if self.loyalty_tier and self.loyalty_tier != self.LoyaltyTier.REGULAR:
@@ -254,24 +269,87 @@ class Client(models.Model):
         return self.dynamic_tier()
 
     def dynamic_tier(self):
-        from django.db.models import Sum
-        orders = self.order_set.filter(status=Order.Status.COMPLETED)
-        visits = orders.count()
-        total = orders.aggregate(total=Sum('total_amount'))['total'] or 0
+        """Tier earned from completed purchases, read from the client's ClientStats row"""
+        try:
+            stats = self.stats
+        except ClientStats.DoesNotExist:
+            return self.tier_for(0, 0)
+        return self.tier_for(stats.visit_count, stats.lifetime_spend)
+
+    @classmethod
+    def tier_for(cls, visits, total):
         if visits >= 12 and total >= 5000:
-            return self.LoyaltyTier.PLATINUM
+            return cls.LoyaltyTier.PLATINUM
         if visits >= 6 and total >= 1000:
-            return self.LoyaltyTier.GOLD
+            return cls.LoyaltyTier.GOLD
         if visits >= 1:
-            return self.LoyaltyTier.SILVER
-        return self.LoyaltyTier.REGULAR
+            return cls.LoyaltyTier.SILVER
+        return cls.LoyaltyTier.REGULAR
 
     def dynamic_tier_label(self):
-        return self.get_tier_display() if hasattr(self, 'get_tier_display') else self.get_tier()
+        return self.LoyaltyTier(self.get_tier()).label
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}".strip()
 
+class ClientStats(models.Model):
+    """
+    Completed-order count and spend per client, kept up to date by checkout
+    and returns so tier lookups don't aggregate the client's orders.
+    Rebuild with ``manage.py rebuild_client_stats``.
+    """
+    client = models.OneToOneField(Client, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    visit_count = models.IntegerField(default=0)
+    lifetime_spend = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def record(cls, client_id, visits, spend):
+        """Adds ``visits`` / ``spend`` (either may be negative) to a client's totals"""
+        if not client_id or (not visits and not spend):
+            return
+        updated = cls.objects.filter(client_id=client_id).update(
+            visit_count=models.F('visit_count') + visits,
+            lifetime_spend=models.F('lifetime_spend') + spend,
+            updated_at=timezone.now(),
+        )
+        if not updated:
+            stats, created = cls.objects.get_or_create(
+                client_id=client_id,
+                defaults={'visit_count': visits, 'lifetime_spend': spend},
+            )
+            if not created:
+                cls.record(client_id, visits, spend)
+
+    @classmethod
+    def record_status_change(cls, order, old_status):
+        """Keeps the totals right when an order moves into or out of COMPLETED"""
+        was_counted = old_status == Order.Status.COMPLETED
+        is_counted = order.status == Order.Status.COMPLETED
+        if was_counted != is_counted:
+            sign = 1 if is_counted else -1
+            cls.record(order.client_id, sign, sign * order.total_amount)
+
+    @classmethod
+    def rebuild(cls):
+        """Recomputes every client's totals from orders in one grouped query"""
+        totals = (
+            Order.objects.filter(status=Order.Status.COMPLETED, client__isnull=False)
+            .values('client_id')
+            .annotate(visits=models.Count('id'), spend=models.Sum('total_amount'))
+        )
+        rows = [
+            cls(client_id=row['client_id'], visit_count=row['visits'], lifetime_spend=row['spend'] or 0)
+            for row in totals
+        ]
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+    def __str__(self):
+        return f"{self.client}: {self.visit_count} visits, {self.lifetime_spend}"
+
 class LoyaltyAccount(models.Model):
     class Tier(models.TextChoices):
         REGULAR = 'REGULAR', _('Regular')
@@ -340,6 +418,14 @@ class Order(models.Model):
     loyalty_points_earned = models.IntegerField(default=0)
     loyalty_points_redeemed = models.IntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            # client purchase history pages (see history.py)
+            models.Index(fields=['client', '-created_at', '-id'], name='order_client_history_idx'),
+            # per-location recent orders and report exports
+            models.Index(fields=['location', '-created_at'], name='order_location_recent_idx'),
+        ]
+
     def __str__(self):
         return f"Order #{self.order_code or self.id}"
 
@@ -352,6 +438,18 @@ class Order(models.Model):
             return 'RETURN'
         return self.status
 
+class CheckoutIdempotencyKey(models.Model):
+    """Result of a POS checkout, stored under the key the terminal generated for it so retries can't sell twice"""
+    key = models.CharField(max_length=64, unique=True)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='idempotency_keys')
+    status_code = models.PositiveSmallIntegerField(default=200)
+    response = models.JSONField()
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.key} -> {self.order}"
+
 class AppliedDiscount(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='discounts')
     rule = models.ForeignKey(DiscountRule, on_delete=models.PROTECT)
@@ -364,6 +462,8 @@ class OrderItem(models.Model):
     variant = models.ForeignKey(ProductVariant, on_delete=models.PROTECT)
     quantity = models.PositiveIntegerField()
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    # variant cost price when the line was sold; null only on lines not yet backfilled
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     line_discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     qty_returned = models.PositiveIntegerField(
         default=0,
@@ -416,10 +516,13 @@ class Return(models.Model):
     original_order = models.ForeignKey(Order, on_delete=models.PROTECT, related_name='returns')
     refund_order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='refund_source')
     replacement_order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='replacement_source')
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     created_by = models.ForeignKey(User, on_delete=models.PROTECT)
     reason = models.CharField(max_length=50, choices=Reason.choices, default=Reason.OTHER)
     action = models.CharField(max_length=20, choices=Action.choices, default=Action.REFUND)
+    # totals of the returned items, stored so reports can SUM them
+    refund_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    refund_cost = models.DecimalField(max_digits=12, decimal_places=2, default=0)
 
     def __str__(self):
         return f"Return for {self.original_order} ({self.get_action_display()})"
@@ -429,6 +532,9 @@ class ReturnItem(models.Model):
     order_item = models.ForeignKey(OrderItem, on_delete=models.PROTECT)
     quantity = models.PositiveIntegerField()
     reason = models.CharField(max_length=50, choices=Return.Reason.choices, blank=True, null=True)
+    # price paid and cost of one unit, copied from the order line when the return is made
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
     def __str__(self):
         return f"{self.quantity} x {self.order_item.variant} (Return)"
@@ -558,7 +664,7 @@ class Promotion(models.Model):
         if self.applies_to == self.AppliesTo.BRAND:
             return product.brand == self.brand
         if self.applies_to == self.AppliesTo.PRODUCTS:
-            return self.products.filter(id=product.id).exists()
+            return self.product_links.filter(product_id=product.id).exists()
         return False
 
     def calculate_discount(self, cart_items, client=None):
@@ -566,79 +672,10 @@ class Promotion(models.Model):
         Calculate the discount for given cart items.
         Returns (discount_amount, discount_description)
         """
-        from decimal import Decimal
-        
-        if not self.is_valid():
-            return Decimal('0'), ''
-        
-        if not self.can_apply_to_customer(client):
-            return Decimal('0'), ''
-
-        applicable_items = []
-        for item in cart_items:
-            product = item.get('product') or item.get('variant').product
-            if self.applies_to_product(product):
-                applicable_items.append(item)
+        from .promotions import CompiledPromotion, promo_lines
 
-        if not applicable_items:
-            return Decimal('0'), ''
-
-        applicable_total = sum(
-            Decimal(str(item.get('price', 0))) * item.get('qty', 1) 
-            for item in applicable_items
-        )
-        total_items = sum(item.get('qty', 1) for item in applicable_items)
-
-        if applicable_total < self.min_purchase:
-            return Decimal('0'), ''
-        if total_items < self.min_items:
-            return Decimal('0'), ''
-
-        discount = Decimal('0')
-        description = ''
-
-        if self.promo_type == self.Type.PERCENTAGE:
-            discount = applicable_total * (Decimal(str(self.discount_value)) / 100)
-            description = f'{self.discount_value}% off'
-
-        elif self.promo_type == self.Type.FIXED:
-            discount = min(Decimal(str(self.discount_value)), applicable_total)
-            description = f'${self.discount_value} off'
-
-        elif self.promo_type == self.Type.BOGO:
-            all_prices = []
-            for item in applicable_items:
-                price = Decimal(str(item.get('price', 0)))
-                for _ in range(item.get('qty', 1)):
-                    all_prices.append(price)
-            
-            all_prices.sort()
-            
-            total_qty = len(all_prices)
-            sets = total_qty // (self.buy_quantity + self.get_quantity)
-            free_items = sets * self.get_quantity
-            
-            if free_items > 0:
-                discount = sum(all_prices[:free_items])
-                description = f'Buy {self.buy_quantity} Get {self.get_quantity} Free'
-
-        elif self.promo_type == self.Type.TIERED:
-            if client:
-                tier = client.get_tier()
-                if tier == Client.LoyaltyTier.PLATINUM:
-                    rate = self.platinum_discount
-                elif tier == Client.LoyaltyTier.GOLD:
-                    rate = self.gold_discount
-                elif tier == Client.LoyaltyTier.SILVER:
-                    rate = self.silver_discount
-                else:
-                    rate = Decimal('0')
-                
-                if rate > 0:
-                    discount = applicable_total * (rate / 100)
-                    description = f'{rate}% VIP discount'
-
-        return discount.quantize(Decimal('0.01')), description
+        compiled = CompiledPromotion.from_model(self)
+        return compiled.calculate(promo_lines(cart_items), tier=lambda: client.get_tier() if client else None)
 
 
 class PromotionProduct(models.Model):
@@ -663,3 +700,103 @@ class PromotionUsage(models.Model):
 
     def __str__(self):
         return f"{self.promotion.name} used on Order #{self.order.id}"
+
+
+class DailyProductSales(models.Model):
+    """
+    Units, revenue and cost per product, location and local day, with
+    refunds booked on the day the return was made. Maintained by checkout
+    and returns (see rollups.py); ``manage.py rebuild_rollups`` recomputes it.
+    """
+    date = models.DateField()
+    location = models.ForeignKey(Location, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    brand = models.CharField(max_length=100)
+    category = models.CharField(max_length=50)
+    quantity = models.IntegerField(default=0)
+    gross_sales = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    returned_quantity = models.IntegerField(default=0)
+    refund_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    refund_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('date', 'location', 'product')
+        indexes = [
+            models.Index(fields=['date', 'category'], name='daily_sales_category_idx'),
+            models.Index(fields=['date', 'brand'], name='daily_sales_brand_idx'),
+            models.Index(fields=['location', 'date'], name='daily_sales_location_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.location} {self.product}: {self.quantity}"
+
+
+class HourlySales(models.Model):
+    """
+    Order-level totals per location and hour: sales (after discounts),
+    exchanges and refunds. Maintained alongside DailyProductSales.
+    """
+    hour = models.DateTimeField()
+    location = models.ForeignKey(Location, on_delete=models.CASCADE)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    discounts = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    items_sold = models.IntegerField(default=0)
+    exchange_orders = models.IntegerField(default=0)
+    exchange_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    returns = models.IntegerField(default=0)
+    refund_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    refund_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('hour', 'location')
+        indexes = [
+            models.Index(fields=['location', 'hour'], name='hourly_sales_location_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H}:00 {self.location}: {self.revenue}"
+
+
+class BackgroundJob(models.Model):
+    """
+    Work queued by a request and run by ``manage.py run_jobs`` (see jobs.py),
+    such as large report exports and label PDFs. The finished file is kept
+    under settings.JOB_FILES_DIR until the job is purged.
+    """
+    class Kind(models.TextChoices):
+        REPORT_EXPORT = 'REPORT_EXPORT', _('Report export')
+        BARCODE_PDF = 'BARCODE_PDF', _('Barcode labels')
+
+    class Status(models.TextChoices):
+        QUEUED = 'QUEUED', _('Queued')
+        RUNNING = 'RUNNING', _('Running')
+        DONE = 'DONE', _('Done')
+        FAILED = 'FAILED', _('Failed')
+
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    params = models.JSONField(default=dict)
+    progress = models.PositiveSmallIntegerField(default=0)
+    message = models.CharField(max_length=255, blank=True)
+    file_name = models.CharField(max_length=255, blank=True)
+    file_path = models.CharField(max_length=500, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # the worker's "oldest queued job" lookup
+            models.Index(fields=['status', 'created_at'], name='job_queue_idx'),
+        ]
+
+    @property
+    def is_finished(self):
+        return self.status in (self.Status.DONE, self.Status.FAILED)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.id} ({self.status})"
@@ -0,0 +1,58 @@
+"""
+Order code allocation.
+
+Codes are derived from the order's primary key, so uniqueness comes from
+the database sequence and no "does this code exist?" query is needed. The
+id is scrambled with an invertible mix before encoding, which keeps codes
+short and non-sequential looking.
+
+Codes are 7 characters of Crockford base32 (no I, L, O or U), so they can
+never collide with the 6-character random codes issued before.
+"""
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+CODE_LENGTH = 7
+CODE_BITS = 5 * CODE_LENGTH
+CODE_SPACE = 1 << CODE_BITS
+_MASK = CODE_SPACE - 1
+
+# odd multipliers are invertible modulo a power of two
+_MULTIPLIER_1 = 0x5BD1E995 & _MASK | 1
+_MULTIPLIER_2 = 0x27D4EB2F & _MASK | 1
+_OFFSET = 0x1F3A5C7E9 & _MASK
+
+# typing mistakes people make with Crockford codes
+_READ_FIXES = str.maketrans({'I': '1', 'L': '1', 'O': '0'})
+
+
+def _mix(n):
+    n = (n * _MULTIPLIER_1 + _OFFSET) & _MASK
+    n ^= n >> 17
+    n = (n * _MULTIPLIER_2) & _MASK
+    n ^= n >> 13
+    return n
+
+
+def _encode(n, length):
+    chars = []
+    for _ in range(length):
+        n, digit = divmod(n, 32)
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def order_code_for(order_id):
+    """Code for an order id; ids past the 7-character space just get longer codes"""
+    if order_id < CODE_SPACE:
+        return _encode(_mix(order_id), CODE_LENGTH)
+    length = CODE_LENGTH
+    while order_id >= 1 << (5 * length):
+        length += 1
+    return _encode(order_id, length)
+
+
+def normalize_order_code(raw):
+    """Cleans up a typed or scanned code: strips '#', uppercases, fixes I/L/O in new-style codes"""
+    code = (raw or '').strip().upper().replace('#', '')
+    if len(code) >= CODE_LENGTH:
+        code = code.translate(_READ_FIXES)
+    return code
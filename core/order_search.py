@@ -0,0 +1,66 @@
+"""
+Order lookup for the dashboard search box.
+
+Each kind of match is its own indexed query rather than one OR across
+columns and joins: exact order code, order code prefix (range on the
+unique index), numeric id, then the newest orders of matching clients via
+the client search columns and the (client, created_at) index.
+"""
+from .client_search import client_search_filter
+from .models import Client, Order
+from .order_codes import normalize_order_code
+
+# shorter code fragments match too much to be useful
+MIN_CODE_PREFIX = 3
+# clients whose orders are pulled in for a name/phone search
+MAX_CLIENTS = 20
+
+
+def _orders(location=None):
+    orders = Order.objects.select_related('client')
+    return orders.filter(location=location) if location else orders
+
+
+def search_orders(query, limit=20, location=None):
+    """
+    Orders matching a typed order code, id or client name/phone, best
+    matches first; only those of ``location`` when given.
+    """
+    raw = (query or '').strip()
+    code = normalize_order_code(raw)
+    if not code:
+        return []
+    found = []
+    seen = set()
+
+    def take(orders):
+        for order in orders:
+            if order.id not in seen and len(found) < limit:
+                seen.add(order.id)
+                found.append(order)
+
+    take(_orders(location).filter(order_code=code))
+    if code.isdigit():
+        take(_orders(location).filter(id=int(code)))
+    if len(code) >= MIN_CODE_PREFIX and len(found) < limit:
+        upper = code[:-1] + chr(ord(code[-1]) + 1)
+        take(_orders(location).filter(order_code__gte=code, order_code__lt=upper).order_by('order_code')[:limit])
+    condition = client_search_filter(raw.lstrip('#'))
+    if condition is not None and len(found) < limit:
+        client_ids = list(Client.objects.filter(condition).values_list('id', flat=True)[:MAX_CLIENTS])
+        if client_ids:
+            take(_orders(location).filter(client_id__in=client_ids).order_by('-created_at', '-id')[:limit])
+    return found
+
+
+def order_row(order):
+    return {
+        'id': order.id,
+        'order_code': order.order_code or str(order.id),
+        'created_at': order.created_at.isoformat(),
+        'client': str(order.client) if order.client else 'Walk-in',
+        'total': float(order.total_amount),
+        'type': order.type,
+        'status': order.status,
+        'status_display': order.get_status_display(),
+    }
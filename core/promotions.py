@@ -0,0 +1,326 @@
+"""
+Promotion evaluation.
+
+Promotions are compiled into plain in-memory snapshots so pricing a cart
+doesn't touch the database. The set of current promotions is built once
+per process and thrown away when a Promotion / PromotionProduct is saved or
+deleted (see signals), when the next promotion starts or ends, or after
+REFRESH_SECONDS as a safety net for edits made in other worker processes.
+"""
+import threading
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .models import Client, Promotion
+
+# how long a compiled set may be reused before it is rebuilt regardless
+REFRESH_SECONDS = 60
+
+TIER_RANK = {
+    Client.LoyaltyTier.REGULAR: 0,
+    Client.LoyaltyTier.SILVER: 1,
+    Client.LoyaltyTier.GOLD: 2,
+    Client.LoyaltyTier.PLATINUM: 3,
+}
+
+REQUIRED_RANK = {
+    Promotion.CustomerTierRestriction.SILVER: 1,
+    Promotion.CustomerTierRestriction.GOLD: 2,
+    Promotion.CustomerTierRestriction.PLATINUM: 3,
+}
+
+PromoLine = namedtuple('PromoLine', ['product_id', 'brand', 'category', 'price', 'qty'])
+
+
+def promo_lines(cart_items):
+    """Converts cart item dicts (with 'product' or 'variant', 'price', 'qty') into PromoLines"""
+    lines = []
+    for item in cart_items:
+        product = item.get('product') or item.get('variant').product
+        lines.append(PromoLine(
+            product.id,
+            product.brand,
+            product.category,
+            Decimal(str(item.get('price', 0))),
+            item.get('qty', 1),
+        ))
+    return lines
+
+
+def cheapest_units_total(lines, count):
+    """
+    Sum of the ``count`` cheapest units across the lines, walking distinct
+    prices with their quantities rather than one entry per unit.
+    """
+    quantities = {}
+    for line in lines:
+        if line.qty > 0:
+            quantities[line.price] = quantities.get(line.price, 0) + line.qty
+    total = Decimal('0')
+    for price in sorted(quantities):
+        if count <= 0:
+            break
+        taken = min(count, quantities[price])
+        total += price * taken
+        count -= taken
+    return total
+
+
+class CompiledPromotion:
+    """Read-only snapshot of a Promotion that prices carts without queries"""
+    def __init__(self, promo, product_ids=()):
+        self.id = promo.id
+        self.name = promo.name
+        self.code = (promo.code or '').upper()
+        self.promo_type = promo.promo_type
+        self.discount_value = Decimal(str(promo.discount_value))
+        self.buy_quantity = promo.buy_quantity
+        self.get_quantity = promo.get_quantity
+        self.silver_discount = Decimal(str(promo.silver_discount))
+        self.gold_discount = Decimal(str(promo.gold_discount))
+        self.platinum_discount = Decimal(str(promo.platinum_discount))
+        self.applies_to = promo.applies_to
+        self.category = promo.category
+        self.brand = promo.brand
+        self.product_ids = frozenset(product_ids)
+        self.customer_tier = promo.customer_tier
+        self.min_purchase = promo.min_purchase
+        self.min_items = promo.min_items
+        self.start_date = promo.start_date
+        self.end_date = promo.end_date
+        self.is_active = promo.is_active
+        self.max_uses = promo.max_uses
+        self.used_count = promo.used_count
+        self.rank = 0
+
+    @classmethod
+    def from_model(cls, promo):
+        product_ids = ()
+        if promo.applies_to == Promotion.AppliesTo.PRODUCTS and promo.pk:
+            product_ids = promo.product_links.values_list('product_id', flat=True)
+        return cls(promo, product_ids)
+
+    def is_valid(self, now):
+        if not self.is_active:
+            return False
+        if now < self.start_date or now > self.end_date:
+            return False
+        if self.max_uses > 0 and self.used_count >= self.max_uses:
+            return False
+        return True
+
+    def needs_tier(self):
+        return (self.customer_tier != Promotion.CustomerTierRestriction.ALL
+                or self.promo_type == Promotion.Type.TIERED)
+
+    def can_apply_to_tier(self, tier):
+        if self.customer_tier == Promotion.CustomerTierRestriction.ALL:
+            return True
+        if tier is None:
+            return False
+        return TIER_RANK.get(tier, 0) >= REQUIRED_RANK.get(self.customer_tier, 4)
+
+    def applies_to_line(self, line):
+        if self.applies_to == Promotion.AppliesTo.ALL:
+            return True
+        if self.applies_to == Promotion.AppliesTo.CATEGORY:
+            return line.category == self.category
+        if self.applies_to == Promotion.AppliesTo.BRAND:
+            return line.brand == self.brand
+        if self.applies_to == Promotion.AppliesTo.PRODUCTS:
+            return line.product_id in self.product_ids
+        return False
+
+    def calculate(self, lines, tier=None, now=None):
+        """
+        Discount for the given PromoLines. ``tier`` is the client's loyalty
+        tier (None for walk-ins) or a callable returning it, so it is only
+        worked out when a promotion actually depends on it.
+        Returns (discount_amount, discount_description).
+        """
+        now = now or timezone.now()
+        if not self.is_valid(now):
+            return Decimal('0'), ''
+        if callable(tier):
+            tier = tier() if self.needs_tier() else None
+        if not self.can_apply_to_tier(tier):
+            return Decimal('0'), ''
+
+        applicable = [line for line in lines if self.applies_to_line(line)]
+        if not applicable:
+            return Decimal('0'), ''
+        return self.calculate_applicable(applicable, tier)
+
+    def calculate_applicable(self, applicable, tier):
+        """Pricing step of calculate() for lines already known to be eligible"""
+        applicable_total = sum(line.price * line.qty for line in applicable)
+        total_items = sum(line.qty for line in applicable)
+
+        if applicable_total < self.min_purchase:
+            return Decimal('0'), ''
+        if total_items < self.min_items:
+            return Decimal('0'), ''
+
+        discount = Decimal('0')
+        description = ''
+
+        if self.promo_type == Promotion.Type.PERCENTAGE:
+            discount = applicable_total * (self.discount_value / 100)
+            description = f'{self.discount_value}% off'
+
+        elif self.promo_type == Promotion.Type.FIXED:
+            discount = min(self.discount_value, applicable_total)
+            description = f'${self.discount_value} off'
+
+        elif self.promo_type == Promotion.Type.BOGO:
+            sets = total_items // (self.buy_quantity + self.get_quantity)
+            free_items = sets * self.get_quantity
+
+            if free_items > 0:
+                discount = cheapest_units_total(applicable, free_items)
+                description = f'Buy {self.buy_quantity} Get {self.get_quantity} Free'
+
+        elif self.promo_type == Promotion.Type.TIERED:
+            if tier is not None:
+                if tier == Client.LoyaltyTier.PLATINUM:
+                    rate = self.platinum_discount
+                elif tier == Client.LoyaltyTier.GOLD:
+                    rate = self.gold_discount
+                elif tier == Client.LoyaltyTier.SILVER:
+                    rate = self.silver_discount
+                else:
+                    rate = Decimal('0')
+
+                if rate > 0:
+                    discount = applicable_total * (rate / 100)
+                    description = f'{rate}% VIP discount'
+
+        return discount.quantize(Decimal('0.01')), description
+
+
+class PromotionSet:
+    """
+    The promotions that are live or scheduled, compiled once and shared by
+    every cart. Automatic promotions are indexed by what they apply to, so
+    a cart costs one dict lookup per line per dimension plus arithmetic for
+    the promotions it actually touches, however many promotions exist.
+    """
+    def __init__(self, promotions, now):
+        self.built_at = now
+        self.automatic = []
+        self.by_code = {}
+        self.universal = []
+        self.by_brand = {}
+        self.by_category = {}
+        self.by_product = {}
+        boundaries = [now + timedelta(seconds=REFRESH_SECONDS)]
+        for promo in promotions:
+            if promo.start_date > now:
+                boundaries.append(promo.start_date)
+            if promo.end_date >= now:
+                boundaries.append(promo.end_date)
+            if promo.code:
+                self.by_code[promo.code] = promo
+            else:
+                self._index(promo)
+        # rebuild when any promotion starts or ends
+        self.expires_at = min(boundaries)
+
+    def _index(self, promo):
+        # position breaks ties the same way the old queryset loop did (newest first)
+        promo.rank = len(self.automatic)
+        self.automatic.append(promo)
+        if promo.applies_to == Promotion.AppliesTo.ALL:
+            self.universal.append(promo)
+        elif promo.applies_to == Promotion.AppliesTo.BRAND:
+            self.by_brand.setdefault(promo.brand, []).append(promo)
+        elif promo.applies_to == Promotion.AppliesTo.CATEGORY:
+            self.by_category.setdefault(promo.category, []).append(promo)
+        elif promo.applies_to == Promotion.AppliesTo.PRODUCTS:
+            for product_id in promo.product_ids:
+                self.by_product.setdefault(product_id, []).append(promo)
+
+    @classmethod
+    def load(cls, now=None):
+        now = now or timezone.now()
+        promotions = (
+            Promotion.objects.filter(is_active=True, end_date__gte=now)
+            .prefetch_related('product_links')
+        )
+        compiled = [
+            CompiledPromotion(promo, [link.product_id for link in promo.product_links.all()])
+            for promo in promotions
+        ]
+        return cls(compiled, now)
+
+    def matching(self, lines):
+        """{promotion: [lines it applies to]} for the automatic promotions the cart touches"""
+        matched = {promo: list(lines) for promo in self.universal} if lines else {}
+        for line in lines:
+            for index, key in ((self.by_brand, line.brand),
+                               (self.by_category, line.category),
+                               (self.by_product, line.product_id)):
+                for promo in index.get(key, ()):
+                    matched.setdefault(promo, []).append(line)
+        return matched
+
+    def best_for(self, lines, client=None, promo_code=None, now=None):
+        """
+        Picks the promotion for a cart the way the POS always has: a valid
+        promo code wins if it gives anything, otherwise the biggest automatic
+        promotion. Returns (promotion or None, amount, description, code_found).
+        """
+        now = now or timezone.now()
+        tier_memo = []
+
+        def tier():
+            if not tier_memo:
+                tier_memo.append(client.get_tier() if client else None)
+            return tier_memo[0]
+
+        code_found = True
+        if promo_code:
+            promo = self.by_code.get(promo_code.upper())
+            code_found = promo is not None and promo.start_date <= now <= promo.end_date
+            if code_found:
+                amount, description = promo.calculate(lines, tier, now)
+                if amount > 0:
+                    return promo, amount, description, True
+
+        best, best_amount, best_desc = None, Decimal('0.00'), ''
+        matched = self.matching(lines)
+        for promo in sorted(matched, key=lambda p: p.rank):
+            if not promo.is_valid(now):
+                continue
+            promo_tier = tier() if promo.needs_tier() else None
+            if not promo.can_apply_to_tier(promo_tier):
+                continue
+            amount, description = promo.calculate_applicable(matched[promo], promo_tier)
+            if amount > best_amount:
+                best, best_amount, best_desc = promo, amount, description
+        return best, best_amount, best_desc, code_found
+
+
+_lock = threading.Lock()
+_current = None
+
+
+def current_promotions():
+    """The compiled PromotionSet for this process, rebuilt when stale"""
+    global _current
+    now = timezone.now()
+    promotions = _current
+    if promotions is None or now >= promotions.expires_at:
+        with _lock:
+            if _current is None or now >= _current.expires_at:
+                _current = PromotionSet.load(now)
+            promotions = _current
+    return promotions
+
+
+def invalidate_promotions():
+    global _current
+    _current = None
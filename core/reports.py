@@ -0,0 +1,292 @@
+"""
+Sales reports.
+
+Every figure is read from the DailyProductSales / HourlySales rollups, so a
+report costs a few grouped queries over O(days x products) rows however many
+orders the period holds, and comparing against last year is just a second
+report. Sales count on the day they were rung up and refunds on the day the
+return was made (see rollups.py).
+
+Computed reports are cached under a data watermark: the rollup generation,
+which every sale, return and rebuild bumps when its transaction commits,
+plus the newest order and return ids. Reports cached before a write commits
+miss afterwards, even when the write commits after one with a higher id.
+The only gap is a process dying between its commit and the generation bump,
+which REPORT_TTL bounds.
+"""
+from collections import namedtuple
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import F, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import DailyProductSales, HourlySales, Location, Order, Return
+from .rollups import day_bounds, generation
+
+DEFAULT_DAYS = 30
+PRESET_DAYS = (7, 30, 90, 365)
+# longest period a single report may cover
+MAX_DAYS = 3 * 366
+# dates a report may start or end on, well inside date.min / date.max so
+# day bounds and comparison periods can't overflow
+FIRST_DAY = date(1900, 1, 1)
+LAST_DAY = date(9998, 12, 31)
+TOP_PRODUCTS = 10
+# upper bound on staleness should a generation bump be lost
+REPORT_TTL = 60 * 15
+
+COMPARE_PREVIOUS = 'previous'
+COMPARE_YEAR = 'year'
+COMPARE_CHOICES = (
+    (COMPARE_PREVIOUS, 'Previous period'),
+    (COMPARE_YEAR, 'Same period last year'),
+)
+
+
+class ReportPeriod(namedtuple('ReportPeriod', ['start', 'end'])):
+    """Inclusive range of local calendar days"""
+
+    @property
+    def days(self):
+        return (self.end - self.start).days + 1
+
+    def bounds(self):
+        """Aware [start, end) datetimes covering the period"""
+        return day_bounds(self.start)[0], day_bounds(self.end)[1]
+
+    def dates(self):
+        return [self.start + timedelta(days=offset) for offset in range(self.days)]
+
+    def previous(self):
+        """The period of the same length ending the day before this one starts"""
+        end = self.start - timedelta(days=1)
+        return ReportPeriod(end - timedelta(days=self.days - 1), end)
+
+    def year_ago(self):
+        return ReportPeriod(_year_before(self.start), _year_before(self.end))
+
+    def compared_with(self, compare):
+        if compare == COMPARE_PREVIOUS:
+            return self.previous()
+        if compare == COMPARE_YEAR:
+            return self.year_ago()
+        return None
+
+
+def _year_before(day):
+    try:
+        return day.replace(year=day.year - 1)
+    except ValueError:  # 29 February
+        return day.replace(year=day.year - 1, day=28)
+
+
+def parse_period(params, today=None):
+    """
+    The report period from query parameters: ``start``/``end`` (YYYY-MM-DD,
+    either may be left out) or ``days`` counting back from today. Returns
+    (period, error); on a bad value error describes it and the period is
+    the default last DEFAULT_DAYS days.
+    """
+    today = today or timezone.localdate()
+    default = ReportPeriod(today - timedelta(days=DEFAULT_DAYS - 1), today)
+    start, end = params.get('start'), params.get('end')
+    try:
+        if start or end:
+            start = _parse_day(start) if start else None
+            end = _parse_day(end) if end else today
+            start = start or end - timedelta(days=DEFAULT_DAYS - 1)
+            if start > end:
+                raise ValueError('The start date must be on or before the end date.')
+        else:
+            days = params.get('days') or DEFAULT_DAYS
+            try:
+                days = int(days)
+            except (TypeError, ValueError):
+                raise ValueError(f'"{days}" is not a number of days.')
+            if days < 1:
+                raise ValueError('The number of days must be at least 1.')
+            if days > MAX_DAYS:
+                return _longest_ending(today)
+            start, end = today - timedelta(days=days - 1), today
+    except (ValueError, OverflowError) as e:
+        return default, str(e)
+    period = ReportPeriod(start, end)
+    if period.days > MAX_DAYS:
+        return _longest_ending(end)
+    return period, None
+
+
+def _longest_ending(end):
+    return ReportPeriod(end - timedelta(days=MAX_DAYS - 1), end), f'Reports cover at most {MAX_DAYS} days.'
+
+
+def parse_location(params):
+    """
+    The Location chosen by the ``location`` query parameter. Returns
+    (location, error); location is None for the whole chain, which is also
+    what a bad value falls back to.
+    """
+    value = params.get('location')
+    if not value:
+        return None, None
+    location = Location.objects.filter(pk=value).first() if str(value).isdigit() else None
+    if location is None:
+        return None, f'Unknown location "{value}".'
+    return location, None
+
+
+def report_query(period, location=None):
+    """Query string that selects this period and location again (for export and pivot links)"""
+    query = f'start={period.start.isoformat()}&end={period.end.isoformat()}'
+    return f'{query}&location={location.pk}' if location else query
+
+
+def _parse_day(value):
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValueError(f'"{value}" is not a valid date (use YYYY-MM-DD).')
+    if not FIRST_DAY <= day <= LAST_DAY:
+        raise ValueError(f'Dates must be between {FIRST_DAY.isoformat()} and {LAST_DAY.isoformat()}.')
+    return day
+
+
+def _percent(part, whole):
+    return (part / whole * 100) if whole else Decimal('0')
+
+
+def product_sales(period, location=None):
+    """Units and gross sales per product over the period, one row per product"""
+    days = DailyProductSales.objects.filter(date__range=(period.start, period.end))
+    if location:
+        days = days.filter(location=location)
+    return (
+        days.values('product_id', 'product__name', 'brand')
+        .annotate(total_qty=Sum('quantity'), total_revenue=Sum('gross_sales'))
+        .filter(total_qty__gt=0)
+    )
+
+
+def sales_report(period, location=None):
+    """
+    Figures for a ReportPeriod, for one Location or the whole chain: totals,
+    the daily series and the top product / category / brand / location
+    breakdowns.
+    """
+    start, end = period.bounds()
+    hours = HourlySales.objects.filter(hour__gte=start, hour__lt=end)
+    days = DailyProductSales.objects.filter(date__range=(period.start, period.end))
+    if location:
+        hours = hours.filter(location=location)
+        days = days.filter(location=location)
+
+    totals = hours.aggregate(
+        revenue=Sum('revenue'), exchange_revenue=Sum('exchange_revenue'),
+        orders=Sum('orders'), exchange_orders=Sum('exchange_orders'),
+        refunds=Sum('refund_amount'), refund_cost=Sum('refund_cost'),
+    )
+    lines = days.aggregate(quantity=Sum('quantity'), cost=Sum('cost'))
+
+    total_revenue = (totals['revenue'] or Decimal('0')) + (totals['exchange_revenue'] or Decimal('0'))
+    total_refunds = totals['refunds'] or Decimal('0')
+    net_revenue = total_revenue - total_refunds
+    sales_cost = lines['cost'] or Decimal('0')
+    total_cost = sales_cost - (totals['refund_cost'] or Decimal('0'))
+    gross_profit = total_revenue - sales_cost
+    total_profit = net_revenue - total_cost
+    total_orders = (totals['orders'] or 0) + (totals['exchange_orders'] or 0)
+
+    revenue_by_day = {day: Decimal('0') for day in period.dates()}
+    orders_by_day = dict.fromkeys(revenue_by_day, 0)
+    per_hour = hours.values('hour').annotate(
+        day_revenue=Sum(F('revenue') + F('exchange_revenue')),
+        day_orders=Sum(F('orders') + F('exchange_orders')),
+    ).order_by()
+    for row in per_hour:
+        day = timezone.localdate(row['hour'])
+        if day in revenue_by_day:
+            revenue_by_day[day] += row['day_revenue'] or 0
+            orders_by_day[day] += row['day_orders'] or 0
+
+    products = product_sales(period, location)
+
+    location_sales = [
+        dict(row, net_revenue=row['revenue'] - row['refunds'])
+        for row in hours.values('location_id', 'location__name', 'location__is_store', 'location__is_warehouse')
+        .annotate(
+            revenue=Sum(F('revenue') + F('exchange_revenue')),
+            orders=Sum(F('orders') + F('exchange_orders')),
+            refunds=Sum('refund_amount'),
+        )
+        .order_by('-revenue')
+    ]
+
+    return {
+        'period': period,
+        'location': location,
+        'computed_at': timezone.now(),
+        'total_revenue': total_revenue,
+        'total_refunds': abs(total_refunds),
+        'net_revenue': net_revenue,
+        'total_cost': total_cost,
+        'total_profit': total_profit,
+        'profit_margin': _percent(total_profit, total_revenue if total_revenue > 0 else net_revenue),
+        'gross_profit': gross_profit,
+        'gross_margin': _percent(gross_profit, total_revenue),
+        'total_orders': total_orders,
+        'total_items': lines['quantity'] or 0,
+        'avg_order_value': net_revenue / total_orders if total_orders > 0 else Decimal('0'),
+        'chart_labels': [day.strftime('%b %d') for day in revenue_by_day],
+        'chart_revenue': [float(amount) for amount in revenue_by_day.values()],
+        'chart_orders': list(orders_by_day.values()),
+        'top_products': list(products.order_by('-total_revenue')[:TOP_PRODUCTS]),
+        'top_by_qty': list(products.order_by('-total_qty')[:TOP_PRODUCTS]),
+        'category_sales': list(
+            days.values('category').annotate(total_revenue=Sum('gross_sales')).order_by('-total_revenue')
+        ),
+        'brand_sales': list(
+            days.values('brand').annotate(total_qty=Sum('quantity'), total_revenue=Sum('gross_sales'))
+            .order_by('-total_revenue')
+        ),
+        'location_sales': location_sales,
+    }
+
+
+def data_watermark():
+    """Changes whenever a sale or return commits or the rollups are rebuilt"""
+    return (
+        generation(),
+        Order.objects.order_by('-id').values_list('id', flat=True).first() or 0,
+        Return.objects.order_by('-id').values_list('id', flat=True).first() or 0,
+    )
+
+
+def cached_report(period, location=None, watermark=None):
+    """sales_report(period, location), from the cache when nothing has changed since it was computed"""
+    watermark = watermark or data_watermark()
+    key = 'report:{}:{}:{}:{}'.format(period.start.isoformat(), period.end.isoformat(),
+                                      location.pk if location else 'all',
+                                      '.'.join(str(part) for part in watermark))
+    report = cache.get(key)
+    if report is None:
+        report = sales_report(period, location)
+        cache.set(key, report, REPORT_TTL)
+    return report
+
+
+COMPARED_FIGURES = ('net_revenue', 'total_cost', 'gross_profit', 'avg_order_value',
+                    'total_orders', 'total_items', 'total_refunds')
+
+
+def compare_reports(current, previous):
+    """{figure: percentage change} for COMPARED_FIGURES; None where the earlier figure is zero"""
+    changes = {}
+    for figure in COMPARED_FIGURES:
+        before, now = previous[figure], current[figure]
+        changes[figure] = (Decimal(now - before) / abs(Decimal(before)) * 100) if before else None
+    return changes
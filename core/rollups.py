@@ -0,0 +1,239 @@
+"""
+Sales rollups.
+
+DailyProductSales and HourlySales hold running totals that checkout and
+return processing add to inside their own transactions, so the dashboard
+and reports read a handful of pre-aggregated rows instead of scanning
+orders. Sales are booked when they are rung up and refunds when the return
+is made; a later return doesn't rewrite the day of the original sale.
+
+``rebuild()`` (``manage.py rebuild_rollups``) recomputes everything from
+orders and returns with grouped queries.
+
+Every change bumps a generation in the cache once its transaction commits,
+so caches of figures read from the rollups (see reports.py) can tell when
+they are out of date, whatever order the writers commit in.
+"""
+import time
+from datetime import datetime, timedelta
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+from .models import DailyProductSales, HourlySales, Order, OrderItem, Return, ReturnItem
+
+# statuses of orders that were rung up as sales, whatever was returned afterwards
+SOLD_STATUSES = [Order.Status.COMPLETED, Order.Status.PARTIALLY_RETURNED, Order.Status.FULLY_RETURNED]
+SOLD_TYPES = [Order.Type.SALE, Order.Type.EXCHANGE]
+
+DAILY_KEY = ('date', 'location_id', 'product_id')
+HOURLY_KEY = ('hour', 'location_id')
+
+_MONEY = DecimalField(max_digits=14, decimal_places=2)
+_GENERATION_KEY = 'rollups:gen'
+
+
+def hour_of(moment):
+    """Start of the local hour containing ``moment``, as an aware datetime"""
+    return timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+
+
+def day_bounds(day):
+    """Aware [start, end) of a local calendar day, for range filters on datetimes"""
+    start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+
+
+def generation():
+    """Changes after every committed write to the rollups"""
+    return cache.get(_GENERATION_KEY, 0)
+
+
+def _changed():
+    transaction.on_commit(lambda: cache.set(_GENERATION_KEY, time.time_ns(), None))
+
+
+def _add(counters, field, amount):
+    counters[field] = counters.get(field, 0) + amount
+
+
+def _bump(model, key_fields, deltas, defaults=None):
+    """
+    Adds ``deltas`` ({key tuple: {field: amount}}) to the rows with those
+    keys, creating the missing ones. Existing rows are locked and written
+    back with one bulk_update; if another transaction creates one of the
+    missing rows first, the unique key rejects ours and we go round again.
+    """
+    if not deltas:
+        return
+    defaults = defaults or {}
+    counters = sorted({field for amounts in deltas.values() for field in amounts})
+    lookup = {f'{field}__in': {key[i] for key in deltas} for i, field in enumerate(key_fields)}
+    while True:
+        existing = {}
+        for row in model.objects.select_for_update().filter(**lookup):
+            key = tuple(getattr(row, field) for field in key_fields)
+            if key in deltas:
+                existing[key] = row
+        for key, row in existing.items():
+            for field, amount in deltas[key].items():
+                setattr(row, field, getattr(row, field) + amount)
+        missing = [
+            model(**dict(zip(key_fields, key)), **defaults.get(key, {}), **deltas[key])
+            for key in deltas if key not in existing
+        ]
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(missing)
+        except IntegrityError:
+            continue
+        model.objects.bulk_update(existing.values(), counters)
+        return
+
+
+def record_sale(order, lines):
+    """
+    Books a completed SALE or EXCHANGE order. ``lines`` are
+    (product, qty, unit_price, unit_cost) tuples.
+    """
+    day = timezone.localdate(order.created_at)
+    daily, labels = {}, {}
+    items = 0
+    for product, qty, price, cost in lines:
+        key = (day, order.location_id, product.id)
+        counters = daily.setdefault(key, {})
+        _add(counters, 'quantity', qty)
+        _add(counters, 'gross_sales', price * qty)
+        _add(counters, 'cost', (cost or 0) * qty)
+        labels[key] = {'brand': product.brand, 'category': product.category}
+        items += qty
+    if order.type == Order.Type.EXCHANGE:
+        hourly = {'exchange_orders': 1, 'exchange_revenue': order.total_amount}
+    else:
+        hourly = {'orders': 1, 'revenue': order.total_amount,
+                  'discounts': order.total_discount, 'items_sold': items}
+    _bump(DailyProductSales, DAILY_KEY, daily, labels)
+    _bump(HourlySales, HOURLY_KEY, {(hour_of(order.created_at), order.location_id): hourly})
+    _changed()
+
+
+def record_return(return_obj, location_id, lines):
+    """
+    Books a return against the day it was made. ``lines`` are
+    (product, qty, unit_price, unit_cost) tuples.
+    """
+    day = timezone.localdate(return_obj.created_at)
+    daily, labels = {}, {}
+    for product, qty, price, cost in lines:
+        key = (day, location_id, product.id)
+        counters = daily.setdefault(key, {})
+        _add(counters, 'returned_quantity', qty)
+        _add(counters, 'refund_amount', price * qty)
+        _add(counters, 'refund_cost', cost * qty)
+        labels[key] = {'brand': product.brand, 'category': product.category}
+    _bump(DailyProductSales, DAILY_KEY, daily, labels)
+    _bump(HourlySales, HOURLY_KEY, {(hour_of(return_obj.created_at), location_id): {
+        'returns': 1,
+        'refund_amount': return_obj.refund_amount,
+        'refund_cost': return_obj.refund_cost,
+    }})
+    _changed()
+
+
+def rebuild():
+    """Recomputes both rollup tables from orders and returns. Returns (daily rows, hourly rows)."""
+    tz = timezone.get_current_timezone()
+    daily, labels, hourly = {}, {}, {}
+
+    sold_lines = (
+        OrderItem.objects.filter(order__status__in=SOLD_STATUSES, order__type__in=SOLD_TYPES)
+        .annotate(day=TruncDate('order__created_at', tzinfo=tz))
+        .values('day', 'order__location_id', 'variant__product_id',
+                'variant__product__brand', 'variant__product__category')
+        .annotate(
+            qty=Sum('quantity'),
+            gross=Sum(F('quantity') * F('unit_price'), output_field=_MONEY),
+            cost=Sum(F('quantity') * F('unit_cost'), output_field=_MONEY),
+        )
+    )
+    for row in sold_lines.iterator():
+        key = (row['day'], row['order__location_id'], row['variant__product_id'])
+        counters = daily.setdefault(key, {})
+        _add(counters, 'quantity', row['qty'])
+        _add(counters, 'gross_sales', row['gross'] or 0)
+        _add(counters, 'cost', row['cost'] or 0)
+        labels[key] = (row['variant__product__brand'], row['variant__product__category'])
+
+    returned_lines = (
+        ReturnItem.objects
+        .annotate(day=TruncDate('return_process__created_at', tzinfo=tz))
+        .values('day', 'return_process__original_order__location_id', 'order_item__variant__product_id',
+                'order_item__variant__product__brand', 'order_item__variant__product__category')
+        .annotate(
+            qty=Sum('quantity'),
+            amount=Sum(F('quantity') * F('unit_price'), output_field=_MONEY),
+            cost=Sum(F('quantity') * F('unit_cost'), output_field=_MONEY),
+        )
+    )
+    for row in returned_lines.iterator():
+        key = (row['day'], row['return_process__original_order__location_id'], row['order_item__variant__product_id'])
+        counters = daily.setdefault(key, {})
+        _add(counters, 'returned_quantity', row['qty'])
+        _add(counters, 'refund_amount', row['amount'] or 0)
+        _add(counters, 'refund_cost', row['cost'] or 0)
+        labels[key] = (row['order_item__variant__product__brand'], row['order_item__variant__product__category'])
+
+    sold_orders = (
+        Order.objects.filter(status__in=SOLD_STATUSES, type__in=SOLD_TYPES)
+        .annotate(hour=TruncHour('created_at', tzinfo=tz))
+        .values('hour', 'location_id', 'type')
+        .annotate(orders=Count('id'), revenue=Sum('total_amount'), discounts=Sum('total_discount'))
+    )
+    for row in sold_orders.iterator():
+        counters = hourly.setdefault((row['hour'], row['location_id']), {})
+        if row['type'] == Order.Type.EXCHANGE:
+            _add(counters, 'exchange_orders', row['orders'])
+            _add(counters, 'exchange_revenue', row['revenue'] or 0)
+        else:
+            _add(counters, 'orders', row['orders'])
+            _add(counters, 'revenue', row['revenue'] or 0)
+            _add(counters, 'discounts', row['discounts'] or 0)
+
+    sold_items = (
+        OrderItem.objects.filter(order__status__in=SOLD_STATUSES, order__type=Order.Type.SALE)
+        .annotate(hour=TruncHour('order__created_at', tzinfo=tz))
+        .values('hour', 'order__location_id')
+        .annotate(qty=Sum('quantity'))
+    )
+    for row in sold_items.iterator():
+        _add(hourly.setdefault((row['hour'], row['order__location_id']), {}), 'items_sold', row['qty'])
+
+    returns = (
+        Return.objects.annotate(hour=TruncHour('created_at', tzinfo=tz))
+        .values('hour', 'original_order__location_id')
+        .annotate(count=Count('id'), amount=Sum('refund_amount'), cost=Sum('refund_cost'))
+    )
+    for row in returns.iterator():
+        counters = hourly.setdefault((row['hour'], row['original_order__location_id']), {})
+        _add(counters, 'returns', row['count'])
+        _add(counters, 'refund_amount', row['amount'] or 0)
+        _add(counters, 'refund_cost', row['cost'] or 0)
+
+    with transaction.atomic():
+        DailyProductSales.objects.all().delete()
+        HourlySales.objects.all().delete()
+        DailyProductSales.objects.bulk_create([
+            DailyProductSales(date=day, location_id=location_id, product_id=product_id,
+                              brand=labels[key][0], category=labels[key][1], **counters)
+            for key, counters in daily.items()
+            for day, location_id, product_id in [key]
+        ], batch_size=1000)
+        HourlySales.objects.bulk_create([
+            HourlySales(hour=hour, location_id=location_id, **counters)
+            for (hour, location_id), counters in hourly.items()
+        ], batch_size=1000)
+        _changed()
+    return len(daily), len(hourly)
@@ -0,0 +1,48 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Client, Product, ProductVariant, CatalogTombstone, Promotion, PromotionProduct
+from .client_search import search_keys
+from .dashboard_cache import LOW_STOCK, PROMOTIONS, TOP_PRODUCTS, dashboard_changed
+from .promotions import invalidate_promotions
+
+
+@receiver(post_save, sender=Product)
+def touch_product_variants(sender, instance, **kwargs):
+    # brand/name/image live on the product, so bump its variants for catalog sync
+    ProductVariant.objects.filter(product=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=ProductVariant)
+def record_variant_tombstone(sender, instance, **kwargs):
+    CatalogTombstone.objects.create(variant_id=instance.id, sku=instance.sku)
+
+
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+@receiver(post_save, sender=PromotionProduct)
+@receiver(post_delete, sender=PromotionProduct)
+def drop_compiled_promotions(sender, **kwargs):
+    invalidate_promotions()
+
+
+@receiver(pre_save, sender=Client)
+def fill_client_search_keys(sender, instance, **kwargs):
+    keys = search_keys(instance.first_name, instance.last_name, instance.phone, instance.email)
+    for field, value in keys.items():
+        setattr(instance, field, value)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def refresh_dashboard_stock(sender, **kwargs):
+    dashboard_changed(LOW_STOCK, TOP_PRODUCTS)
+
+
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+def refresh_dashboard_promotions(sender, **kwargs):
+    dashboard_changed(PROMOTIONS)
@@ -30,3 +30,12 @@ def format_currency(value):
     except (ValueError, TypeError):
         return '$0.00'
 
+@register.filter
+def percent_change(value):
+    """Signed percentage such as +12.5% / -3.0%, or an em dash when there is nothing to compare"""
+    if value is None:
+        return '—'
+    try:
+        return f"{float(value):+.1f}%"
+    except (ValueError, TypeError):
+        return '—'
@@ -0,0 +1,327 @@
+import json
+import random
+import threading
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connections
+from django.test import Client as HttpClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import reports, rollups
+from .catalog import catalog_version
+from .models import (
+    CheckoutIdempotencyKey, Client, ClientStats, DailyProductSales, HourlySales, Location, Order, Product,
+    ProductVariant, Promotion, User,
+)
+from .promotions import CompiledPromotion, PromoLine, cheapest_units_total
+
+
+# keeps report, dashboard and promotion caches out of the project's cache directory
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CheckoutOversellTests(TransactionTestCase):
+    """Parallel POS checkouts of one SKU can't sell more than is in stock"""
+    stock = 5
+    terminals = 20
+
+    def setUp(self):
+        self.cashier = User.objects.create_user('cashier', password='x', role=User.Role.CASHIER)
+        Location.objects.create(name='Main', code='MAIN', address='N/A')
+        product = Product.objects.create(brand='Gucci', name='Marmont Bag', base_sku='GUC1', category='Bags')
+        self.variant = ProductVariant.objects.create(
+            product=product, sku='GUC1-BLK', color='Black', size='M',
+            cost_price=Decimal('50'), retail_price=Decimal('100'), initial_quantity=self.stock,
+        )
+
+    def checkout(self, barrier, results):
+        client = HttpClient()
+        client.force_login(self.cashier)
+        barrier.wait()
+        try:
+            response = client.post(
+                '/pos/checkout/', data=json.dumps({'items': [{'sku': 'GUC1-BLK', 'qty': 1}]}),
+                content_type='application/json',
+            )
+            results.append((response.status_code, response.json()))
+        finally:
+            connections.close_all()
+
+    def test_parallel_checkouts_never_oversell(self):
+        results = []
+        barrier = threading.Barrier(self.terminals, timeout=30)
+        threads = [threading.Thread(target=self.checkout, args=(barrier, results)) for _ in range(self.terminals)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        sold = [data for status, data in results if status == 200]
+        rejected = [data for status, data in results if status != 200]
+        self.assertEqual(len(results), self.terminals)
+        self.assertEqual(len(sold), self.stock)
+        self.assertEqual(len(rejected), self.terminals - self.stock)
+        for data in rejected:
+            self.assertEqual(data['insufficient_stock'][0]['sku'], 'GUC1-BLK')
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.initial_quantity, 0)
+        self.assertEqual(Order.objects.count(), self.stock)
+
+
+def expand_and_sort_bogo(lines, buy_quantity, get_quantity):
+    """The BOGO discount as it was computed before price grouping: one list entry per unit"""
+    all_prices = []
+    for line in lines:
+        for _ in range(line.qty):
+            all_prices.append(line.price)
+    all_prices.sort()
+    sets = len(all_prices) // (buy_quantity + get_quantity)
+    return Decimal(sum(all_prices[:sets * get_quantity])).quantize(Decimal('0.01'))
+
+
+class BogoDiscountTests(SimpleTestCase):
+    """The price-grouped BOGO discount matches the per-unit expand-and-sort one"""
+    carts = 500
+
+    def random_cart(self, rng):
+        # few distinct prices, so carts mix shared and unique prices
+        prices = [Decimal(rng.randint(100, 200000)) / 100 for _ in range(rng.randint(1, 6))]
+        return [
+            PromoLine(rng.randint(1, 20), 'Gucci', 'Bags', rng.choice(prices), rng.randint(0, 12))
+            for _ in range(rng.randint(1, 8))
+        ]
+
+    def test_cheapest_units_total_matches_expand_and_sort(self):
+        rng = random.Random(9)
+        for _ in range(self.carts):
+            lines = self.random_cart(rng)
+            units = sorted(price for line in lines for price in [line.price] * line.qty)
+            count = rng.randint(0, len(units) + 3)
+            self.assertEqual(cheapest_units_total(lines, count), sum(units[:count], Decimal('0')), lines)
+
+    def test_bogo_promotion_matches_expand_and_sort(self):
+        rng = random.Random(2009)
+        now = timezone.now()
+        for _ in range(self.carts):
+            buy_quantity, get_quantity = rng.randint(1, 4), rng.randint(1, 3)
+            promo = CompiledPromotion(Promotion(
+                name='BOGO', promo_type=Promotion.Type.BOGO, buy_quantity=buy_quantity, get_quantity=get_quantity,
+                start_date=now - timedelta(days=1), end_date=now + timedelta(days=1),
+            ))
+            lines = self.random_cart(rng)
+            discount, _ = promo.calculate(lines, now=now)
+            self.assertEqual(discount, expand_and_sort_bogo(lines, buy_quantity, get_quantity),
+                             (buy_quantity, get_quantity, lines))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PurchaseHistoryCursorTests(TestCase):
+    """Keyset paging of a client's purchase history"""
+
+    def setUp(self):
+        owner = User.objects.create_user('owner', password='x', role=User.Role.OWNER)
+        location = Location.objects.create(name='Main', code='MAIN', address='N/A')
+        self.client_obj = Client.objects.create(first_name='Ada', phone='+15550100')
+        now = timezone.now()
+        for minutes in range(5):
+            order = Order.objects.create(client=self.client_obj, location=location, created_by=owner,
+                                         status=Order.Status.COMPLETED, total_amount=Decimal('100'))
+            # two orders share a timestamp, so the id breaks the tie
+            Order.objects.filter(pk=order.pk).update(created_at=now - timedelta(minutes=min(minutes, 3)))
+        self.url = reverse('client_history', args=[self.client_obj.pk])
+        self.client.force_login(owner)
+
+    def page(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_cover_every_order_once(self):
+        seen, cursor = [], None
+        while True:
+            data = self.page(limit=2, **({'cursor': cursor} if cursor else {}))
+            seen.extend(row['id'] for row in data['results'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, list(Order.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_bad_cursor_serves_the_first_page(self):
+        first = [row['id'] for row in self.page(limit=2)['results']]
+        for cursor in ['abc', '123', '99999999999999999999999.1', '1.99999999999999999999999', '-5.1', '.']:
+            self.assertEqual([row['id'] for row in self.page(limit=2, cursor=cursor)['results']], first, cursor)
+        response = self.client.get(reverse('client_detail', args=[self.client_obj.pk]),
+                                   {'cursor': '99999999999999999999999.1'})
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ShopTestCase(TestCase):
+    """A store with two bags in stock, a client and a logged-in owner"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner', password='x', role=User.Role.OWNER)
+        self.location = Location.objects.create(name='Main', code='MAIN', address='N/A')
+        gucci = Product.objects.create(brand='Gucci', name='Marmont Bag', base_sku='GUC1', category='Bags')
+        prada = Product.objects.create(brand='Prada', name='Re-Edition', base_sku='PRA1', category='Bags')
+        self.gucci = ProductVariant.objects.create(
+            product=gucci, sku='GUC1-BLK', color='Black', size='M',
+            cost_price=Decimal('50'), retail_price=Decimal('100'), initial_quantity=10,
+        )
+        self.prada = ProductVariant.objects.create(
+            product=prada, sku='PRA1-RED', color='Red', size='S',
+            cost_price=Decimal('80'), retail_price=Decimal('150'), initial_quantity=10,
+        )
+        self.client_obj = Client.objects.create(first_name='Ada', last_name='Lovelace', phone='+15550100')
+        self.client.force_login(self.owner)
+
+    def post(self, url, payload):
+        return self.client.post(url, data=json.dumps(payload), content_type='application/json')
+
+    def checkout(self, items, **payload):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post(reverse('pos_checkout'), dict(payload, items=items))
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def return_items(self, order_code, returned, replacements=()):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.post(reverse('pos_return_checkout'), {
+                'order_code': order_code,
+                'action': 'EXCHANGE' if replacements else 'REFUND',
+                'return_items': [{'id': item_id, 'qty': qty} for item_id, qty in returned],
+                'replacement_items': list(replacements),
+            })
+
+    def item_id(self, order_id, variant):
+        return Order.objects.get(pk=order_id).items.get(variant=variant).pk
+
+
+class BatchCheckoutTests(ShopTestCase):
+    """Offline carts flushed in a batch: bad carts are answered one by one and replays don't sell twice"""
+
+    def test_bad_cart_does_not_sink_the_batch(self):
+        carts = [
+            {'idempotency_key': 'till1-1', 'items': [{'sku': 'GUC1-BLK', 'qty': 1, 'price': 100}]},
+            {'idempotency_key': 'till1-2', 'items': [{'sku': 'GUC1-BLK', 'qty': 'abc', 'price': 100}]},
+            {'idempotency_key': 'till1-3', 'items': [{'sku': 'GUC1-BLK', 'qty': 1, 'price': 'free'}]},
+            {'idempotency_key': 'till1-4', 'items': [{'sku': 'GUC1-BLK', 'qty': 1, 'price': 100}], 'discount': '5%'},
+            {'idempotency_key': 'till1-5', 'items': 'GUC1-BLK'},
+            {'items': [{'sku': 'PRA1-RED', 'qty': 1, 'price': 150}]},
+            {'idempotency_key': 'till1-7', 'items': [{'sku': 'PRA1-RED', 'qty': 2, 'price': 150}]},
+        ]
+        response = self.post(reverse('pos_checkout_batch'), {'carts': carts})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], [200, 400, 400, 400, 400, 400, 200])
+        self.assertEqual(Order.objects.count(), 2)
+
+        # the terminal retries the whole queue: sales are replayed, not rung up again
+        replay = self.post(reverse('pos_checkout_batch'), {'carts': carts}).json()['results']
+        self.assertEqual([result['status'] for result in replay], [200, 400, 400, 400, 400, 400, 200])
+        self.assertEqual([result['replayed'] for result in replay], [True, False, False, False, False, False, True])
+        self.assertEqual(replay[0]['result'], results[0]['result'])
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(CheckoutIdempotencyKey.objects.count(), 2)
+        self.gucci.refresh_from_db()
+        self.prada.refresh_from_db()
+        self.assertEqual((self.gucci.initial_quantity, self.prada.initial_quantity), (9, 8))
+
+
+class ReturnTests(ShopTestCase):
+    def test_second_full_return_is_rejected(self):
+        sale = self.checkout([{'sku': 'GUC1-BLK', 'qty': 2, 'price': 100}], client_id=self.client_obj.pk)
+        item_id = self.item_id(sale['order_id'], self.gucci)
+        self.assertEqual(ClientStats.objects.get(client=self.client_obj).visit_count, 1)
+
+        self.assertEqual(self.return_items(sale['order_code'], [(item_id, 2)]).status_code, 200)
+        self.assertEqual(self.return_items(sale['order_code'], [(item_id, 1)]).status_code, 400)
+
+        order = Order.objects.get(pk=sale['order_id'])
+        self.assertEqual(order.status, Order.Status.FULLY_RETURNED)
+        stats = ClientStats.objects.get(client=self.client_obj)
+        self.assertEqual((stats.visit_count, stats.lifetime_spend), (0, Decimal('0')))
+        self.gucci.refresh_from_db()
+        self.assertEqual(self.gucci.initial_quantity, 10)
+
+
+class RollupTests(ShopTestCase):
+    """The rollups kept up by checkout and returns match a rebuild from orders"""
+
+    def snapshot(self):
+        daily = DailyProductSales.objects.order_by('date', 'location', 'product').values_list(
+            'date', 'location', 'product', 'brand', 'category', 'quantity', 'gross_sales', 'cost',
+            'returned_quantity', 'refund_amount', 'refund_cost',
+        )
+        hourly = HourlySales.objects.order_by('hour', 'location').values_list(
+            'hour', 'location', 'orders', 'revenue', 'discounts', 'items_sold', 'exchange_orders',
+            'exchange_revenue', 'returns', 'refund_amount', 'refund_cost',
+        )
+        return list(daily), list(hourly)
+
+    def test_incremental_rollups_match_rebuild(self):
+        sale = self.checkout([
+            {'sku': 'GUC1-BLK', 'qty': 2, 'price': 100},
+            {'sku': 'PRA1-RED', 'qty': 1, 'price': 150},
+        ], client_id=self.client_obj.pk, discount='10')
+        self.checkout([{'sku': 'PRA1-RED', 'qty': 1, 'price': 140}])
+        response = self.return_items(
+            sale['order_code'], [(self.item_id(sale['order_id'], self.gucci), 1)],
+            replacements=[{'sku': 'PRA1-RED', 'qty': 1, 'price': 150}],
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+
+        incremental = self.snapshot()
+        self.assertTrue(incremental[0] and incremental[1])
+        rollups.rebuild()
+        self.assertEqual(self.snapshot(), incremental)
+
+
+class ReportCacheTests(ShopTestCase):
+    def test_committed_sale_invalidates_cached_reports(self):
+        self.checkout([{'sku': 'GUC1-BLK', 'qty': 1, 'price': 100}])
+        period = reports.ReportPeriod(timezone.localdate(), timezone.localdate())
+        before = reports.cached_report(period)
+        self.assertEqual(reports.cached_report(period)['computed_at'], before['computed_at'])
+
+        self.checkout([{'sku': 'PRA1-RED', 'qty': 1, 'price': 150}])
+        after = reports.cached_report(period)
+        self.assertEqual((before['total_orders'], after['total_orders']), (1, 2))
+
+    def test_generation_moves_on_commit_only(self):
+        generation = rollups.generation()
+        with self.captureOnCommitCallbacks() as callbacks:
+            rollups.record_sale(Order(location=self.location, created_at=timezone.now(),
+                                      total_amount=Decimal('0')), [])
+        self.assertEqual(rollups.generation(), generation)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(rollups.generation(), generation)
+
+
+class CatalogSyncTests(ShopTestCase):
+    def test_delta_since_cursor(self):
+        full = self.client.get(reverse('pos_catalog')).json()
+        self.assertTrue(full['full'])
+        self.assertEqual(len(full['rows']), 2)
+
+        ProductVariant.objects.filter(pk=self.prada.pk).update(
+            retail_price=Decimal('175'), updated_at=timezone.now() + timedelta(seconds=10),
+        )
+        delta = self.client.get(reverse('pos_catalog'), {'since': full['version']}).json()
+        self.assertFalse(delta['full'])
+        self.assertEqual(delta['version'], catalog_version())
+        prada = [row for row in delta['rows'] if row[0] == self.prada.pk]
+        self.assertEqual(prada[0][full['fields'].index('price')], 175.0)
+
+    def test_bad_cursor_gets_a_full_snapshot(self):
+        for since in ['abc', '-1', '99999999999999999999999']:
+            response = self.client.get(reverse('pos_catalog'), {'since': since})
+            self.assertEqual(response.status_code, 200, since)
+            self.assertTrue(response.json()['full'], since)
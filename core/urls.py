@@ -8,6 +8,7 @@ urlpatterns = [
     path('health/', views.health, name='health'),
     path('logout/', LogoutView.as_view(next_page='login'), name='logout'),
     path('dashboard/', views.DashboardView.as_view(), name='dashboard'),
+    path('dashboard/events/', views.DashboardEventsView.as_view(), name='dashboard_events'),
     path('associate/', views.SalesAssociateDashboardView.as_view(), name='associate_dashboard'),
     
     path('products/', views.ProductListView.as_view(), name='product_list'),
@@ -26,16 +27,22 @@ urlpatterns = [
     path('clients/', views.ClientListView.as_view(), name='client_list'),
     path('clients/new/', views.ClientCreateView.as_view(), name='client_create'),
     path('clients/<int:pk>/', views.ClientDetailView.as_view(), name='client_detail'),
+    path('clients/<int:pk>/history/', views.ClientHistoryView.as_view(), name='client_history'),
     path('clients/<int:pk>/edit/', views.ClientUpdateView.as_view(), name='client_edit'),
     
     path('pos/', views.POSView.as_view(), name='pos'),
     path('pos/checkout/', views.POSCheckoutView.as_view(), name='pos_checkout'),
+    path('pos/checkout/batch/', views.POSBatchCheckoutView.as_view(), name='pos_checkout_batch'),
+    path('pos/catalog/', views.POSCatalogView.as_view(), name='pos_catalog'),
     path('pos/preview-discount/', views.POSPreviewDiscountView.as_view(), name='pos_preview_discount'),
+    path('pos/search/', views.POSSearchView.as_view(), name='pos_search'),
+    path('pos/clients/lookup/', views.POSClientLookupView.as_view(), name='pos_client_lookup'),
     path('pos/return/', views.POSReturnView.as_view(), name='pos_return'),
     path('pos/return/lookup/', views.POSReturnLookupView.as_view(), name='pos_return_lookup'),
     path('pos/return/checkout/', views.POSReturnCheckoutView.as_view(), name='pos_return_checkout'),
     
     path('orders/', views.OrderListView.as_view(), name='order_list'),
+    path('orders/search/', views.OrderSearchView.as_view(), name='order_search'),
     path('orders/<int:pk>/', views.OrderDetailView.as_view(), name='order_detail'),
     
     path('promotions/', views.PromotionListView.as_view(), name='promotion_list'),
@@ -46,6 +53,10 @@ urlpatterns = [
     
     path('reports/', views.ReportView.as_view(), name='reports'),
     path('reports/export/', views.ReportExportView.as_view(), name='report_export'),
+    path('reports/pivot/', views.ReportPivotView.as_view(), name='report_pivot'),
+    path('jobs/<int:pk>/', views.JobDetailView.as_view(), name='job_detail'),
+    path('jobs/<int:pk>/status/', views.JobStatusView.as_view(), name='job_status'),
+    path('jobs/<int:pk>/download/', views.JobDownloadView.as_view(), name='job_download'),
     
     path('personnel/', views.PersonnelListView.as_view(), name='personnel_list'),
     path('personnel/new/', views.PersonnelCreateView.as_view(), name='personnel_create'),
@@ -1,25 +1,35 @@
 import json
+import os
 from decimal import Decimal, InvalidOperation
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.views import LoginView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import TemplateView, ListView, DetailView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.views.generic import TemplateView, ListView, DetailView, UpdateView
 from django.urls import reverse_lazy
 from django.views import View
 from django.contrib import messages
-from django.db import transaction
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.db import transaction, IntegrityError
+from django.http import Http404, JsonResponse, FileResponse, HttpResponse, HttpResponseForbidden, HttpResponseNotModified, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
 from django.utils.decorators import method_decorator
 from django.utils import timezone
-from django.db.models import Sum, F, Q, ProtectedError
+from django.db.models import Sum, Count, F, Q, Case, When, PositiveIntegerField, ProtectedError
 from PIL import Image
-import random
-import string
-from .models import Product, Client, ProductImage, Barcode, ProductVariant, Location, Order, OrderItem, Return, ReturnItem, Promotion, PromotionUsage
+from .models import Product, Client, ProductImage, Barcode, ProductVariant, Location, Order, OrderItem, Return, ReturnItem, Promotion, PromotionUsage, CheckoutIdempotencyKey, ClientStats, DailyProductSales, HourlySales, BackgroundJob
 from .forms import ProductForm, ClientForm, LuxuryProductForm, ProductVariantFormSet, BRAND_CHOICES, MATERIAL_CHOICES, BRAND_SUGGESTIONS, COLOR_SUGGESTIONS
+from .order_codes import order_code_for, normalize_order_code
+from .promotions import PromoLine, current_promotions, invalidate_promotions
+from .catalog import catalog_payload, catalog_version, decode_cursor, search_variants
+from .client_search import search_clients, client_row
+from . import analytics, dashboard_cache, events, exports, jobs, reports, rollups
+from .dashboard_cache import DashboardFragments, dashboard_changed
+from .order_search import search_orders, order_row
+from .history import HISTORY_PAGE_SIZE, purchase_history, lifetime_totals, history_row
+from .labels import INLINE_LABELS, label_variants, write_labels_pdf
 from .permissions import (
     OwnerRequiredMixin, CashierRequiredMixin, SalesAssociateRequiredMixin
 )
@@ -36,81 +46,105 @@ class CustomLoginView(LoginView):
             return reverse_lazy('associate_dashboard')
         return reverse_lazy('dashboard')
 
+# variants below this many units show up in the dashboard's low stock card
+LOW_STOCK_THRESHOLD = 5
+
 class DashboardView(LoginRequiredMixin, TemplateView):
     template_name = 'core/dashboard.html'
+
+    # each fragment is cached per role, day and location (see dashboard_cache)
+    def kpis(self, today, location=None):
+        day_start, day_end = rollups.day_bounds(today)
+        hours = HourlySales.objects.filter(hour__gte=day_start, hour__lt=day_end)
+        if location:
+            hours = hours.filter(location=location)
+        totals = hours.aggregate(
+            revenue=Sum('revenue'), orders=Sum('orders'), items=Sum('items_sold'), refunds=Sum('refund_amount'),
+        )
+        gross_sales = totals['revenue'] or Decimal('0.00')
+        refund_amount = totals['refunds'] or Decimal('0.00')
+        return {
+            'gross_sales': gross_sales,
+            'refund_amount': refund_amount,
+            'net_sales': gross_sales - refund_amount,
+            'items_sold': totals['items'] or 0,
+            'today_count': totals['orders'] or 0,
+            'location_sales': [] if location else list(
+                hours.values('location_id', 'location__name')
+                .annotate(revenue=Sum('revenue'), orders=Sum('orders'), refunds=Sum('refund_amount'))
+                .order_by('-revenue')
+            ),
+        }
+
+    def top_products(self, today, location=None):
+        days = DailyProductSales.objects.filter(date=today, quantity__gt=0)
+        if location:
+            days = days.filter(location=location)
+        return list(
+            days.values('product_id', 'product__name', 'brand')
+            .annotate(total_qty=Sum('quantity'), total_sales=Sum('gross_sales'))
+            .order_by('-total_qty')[:5]
+        )
+
+    def low_stock(self):
+        low = ProductVariant.objects.filter(initial_quantity__lt=LOW_STOCK_THRESHOLD, product__is_archived=False)
+        return {
+            'low_stock': list(low.select_related('product').order_by('-updated_at')[:5]),
+            'low_stock_count': low.count(),
+        }
+
+    def active_promotions(self):
+        now = timezone.now()
+        return list(
+            Promotion.objects.filter(
+                is_active=True,
+                start_date__lte=now,
+                end_date__gte=now
+            ).order_by('-created_at')[:3]
+        )
+
+    def recent_orders(self, location=None):
+        orders = Order.objects.select_related('client')
+        if location:
+            orders = orders.filter(location=location)
+        return list(orders.order_by('-created_at')[:50])
     
     def get_context_data(self, **kwargs):
         # this is quite big but shows stats on main page
         context = super().get_context_data(**kwargs)
         today = timezone.localdate()
         
-        gross_sales = Decimal('0.00')
-        refund_amount = Decimal('0.00')
-        net_sales = Decimal('0.00')
-        items_sold = 0
-        today_count = 0
+        kpis = {
+            'gross_sales': Decimal('0.00'),
+            'refund_amount': Decimal('0.00'),
+            'net_sales': Decimal('0.00'),
+            'items_sold': 0,
+            'today_count': 0,
+            'location_sales': [],
+        }
         recent_orders = []
         top_products = []
-        low_stock = []
-        low_stock_count = 0
+        low_stock = {'low_stock': [], 'low_stock_count': 0}
         active_promotions = []
         db_error = None
         
+        location, error = reports.parse_location(self.request.GET)
+        if error:
+            messages.warning(self.request, f"{error} Showing all locations instead.")
+
         try:
-            today_orders = Order.objects.filter(
-                created_at__date=today, 
-                status=Order.Status.COMPLETED,
-                type=Order.Type.SALE
-            )
-            
-            today_returns = Return.objects.filter(created_at__date=today)
-            for ret in today_returns:
-                for item in ret.items.all():
-                    refund_amount += item.order_item.unit_price * item.quantity
-            
-            gross_sales = today_orders.aggregate(total=Sum('total_amount'))['total'] or Decimal('0.00')
-            net_sales = gross_sales - refund_amount
+            fragments = DashboardFragments(self.request.user.role, today, location.pk if location else None)
+            kpis = fragments.get(dashboard_cache.KPIS, lambda: self.kpis(today, location))
             
-            items_sold = OrderItem.objects.filter(order__in=today_orders).aggregate(qty=Sum('quantity'))['qty'] or 0
-            
-            orders_query = Order.objects.all()
             search_query = self.request.GET.get('search', '').strip()
             if search_query:
-                orders_query = orders_query.filter(
-                    Q(order_code__icontains=search_query) | Q(id__icontains=search_query)
-                )
-            recent_orders = list(orders_query.order_by('-created_at')[:50])
-            
-            top_products = list(
-                OrderItem.objects
-                .filter(order__in=today_orders)
-                .select_related('variant__product')
-                .values('variant__product__id', 'variant__product__name', 'variant__product__brand')
-                .annotate(total_qty=Sum('quantity'), total_sales=Sum(F('quantity') * F('unit_price')))
-                .order_by('-total_qty')[:5]
-            )
-            
-            low_stock = list(
-                ProductVariant.objects
-                .filter(initial_quantity__lt=5, product__is_archived=False)
-                .select_related('product')
-                .order_by('-updated_at')[:5]
-            )
-            
-            low_stock_count = ProductVariant.objects.filter(
-                initial_quantity__lt=5, 
-                product__is_archived=False
-            ).count()
-            
-            active_promotions = list(
-                Promotion.objects.filter(
-                    is_active=True,
-                    start_date__lte=timezone.now(),
-                    end_date__gte=timezone.now()
-                ).order_by('-created_at')[:3]
-            )
+                recent_orders = search_orders(search_query, limit=50, location=location)
+            else:
+                recent_orders = fragments.get(dashboard_cache.RECENT_ORDERS, lambda: self.recent_orders(location))
             
-            today_count = today_orders.count()
+            top_products = fragments.get(dashboard_cache.TOP_PRODUCTS, lambda: self.top_products(today, location))
+            low_stock = fragments.get(dashboard_cache.LOW_STOCK, self.low_stock)
+            active_promotions = fragments.get(dashboard_cache.PROMOTIONS, self.active_promotions)
             
         except Exception as e:
             import logging
@@ -119,21 +153,94 @@ class DashboardView(LoginRequiredMixin, TemplateView):
             db_error = str(e)
             messages.error(self.request, f"Unable to load some dashboard data: {str(e)}")
         
+        context.update(kpis)
+        context.update(low_stock)
         context.update({
-            'gross_sales': gross_sales,
-            'refund_amount': refund_amount,
-            'net_sales': net_sales,
-            'items_sold': items_sold,
-            'today_count': today_count,
             'recent_orders': recent_orders,
             'top_products': top_products,
-            'low_stock': low_stock,
-            'low_stock_count': low_stock_count,
             'active_promotions': active_promotions,
             'db_error': db_error,
+            'today': today.isoformat(),
+            'location': location,
+            'locations': Location.objects.filter(is_store=True).order_by('name'),
         })
         return context
 
+class DashboardEventsView(View):
+    """
+    Server-Sent Events feed for open dashboards: new orders, returns and
+    low stock, each with the KPI deltas to apply. Only served under the
+    ASGI app (aurelion/asgi.py); under WSGI it answers 204, which tells
+    the browser's EventSource not to reconnect.
+    """
+    heartbeat_seconds = 20
+
+    async def get(self, request):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return HttpResponseForbidden()
+        if not isinstance(request, ASGIRequest):
+            return HttpResponse(status=204)
+
+        async def stream():
+            subscription = events.subscribe()
+            try:
+                yield "retry: 5000\n\n"
+                while True:
+                    event = await subscription.next(self.heartbeat_seconds)
+                    if event is None:
+                        yield ": keepalive\n\n"
+                        continue
+                    kind, data = event
+                    yield f"event: {kind}\ndata: {data}\n\n"
+            finally:
+                events.unsubscribe(subscription)
+
+        response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+def publish_sale(order, items_count):
+    """Tells open dashboards about a completed SALE/EXCHANGE order"""
+    is_sale = order.type == Order.Type.SALE
+    row = order_row(order)
+    row['url'] = reverse('order_detail', args=[order.id])
+    events.publish_on_commit('order', {
+        'date': timezone.localdate(order.created_at),
+        'location_id': order.location_id,
+        'order': row,
+        'kpis': {
+            'gross_sales': order.total_amount if is_sale else 0,
+            'today_count': 1 if is_sale else 0,
+            'items_sold': items_count if is_sale else 0,
+        },
+    })
+
+
+def publish_low_stock(variants, sold):
+    """
+    Publishes variants that this sale took below LOW_STOCK_THRESHOLD; ``sold`` is by variant id.
+    Runs in the transaction that deducted the stock, whose UPDATE still locks the rows, so the
+    stock read back is what this sale left and only one sale can see a variant cross.
+    """
+    remaining = dict(
+        ProductVariant.objects.filter(id__in=sold.keys(), initial_quantity__lt=LOW_STOCK_THRESHOLD)
+        .values_list('id', 'initial_quantity')
+    )
+    for variant in variants:
+        if variant.id in remaining and remaining[variant.id] + sold[variant.id] >= LOW_STOCK_THRESHOLD:
+            events.publish_on_commit('low_stock', {
+                'sku': variant.sku,
+                'brand': variant.product.brand,
+                'name': variant.product.name,
+                'color': variant.color,
+                'size': variant.size,
+                'stock': remaining[variant.id],
+            })
+
+
 class OrderListView(CashierRequiredMixin, ListView):
     model = Order
     template_name = 'core/order_list.html'
@@ -143,6 +250,26 @@ class OrderListView(CashierRequiredMixin, ListView):
     def get_queryset(self):
         return Order.objects.order_by('-created_at')
 
+class OrderSearchView(LoginRequiredMixin, View):
+    """Dashboard order search: code (with or without '#'), id, or client name/phone; ?location=<id> narrows it to one store"""
+    max_limit = 50
+
+    def get(self, request):
+        try:
+            limit = min(int(request.GET.get('limit', 20)), self.max_limit)
+        except ValueError:
+            limit = 20
+        location, error = reports.parse_location(request.GET)
+        if error:
+            return JsonResponse({'error': error}, status=400)
+        orders = search_orders(request.GET.get('q', ''), limit=max(limit, 1), location=location)
+        results = []
+        for order in orders:
+            row = order_row(order)
+            row['url'] = reverse('order_detail', args=[order.id])
+            results.append(row)
+        return JsonResponse({'results': results})
+
 class OrderDetailView(LoginRequiredMixin, DetailView):
     model = Order
     template_name = 'core/order_detail.html'
@@ -314,18 +441,13 @@ class BarcodeGeneratorView(CashierRequiredMixin, ListView):
 
 
 class BarcodeGeneratePDFView(CashierRequiredMixin, View):
-    """Generate PDF with barcodes for selected variants"""
+    """Generate PDF with barcodes for selected variants; big runs go to the background worker"""
     def post(self, request):
         import io
-        from reportlab.lib.pagesizes import A4
-        from reportlab.lib.units import mm
-        from reportlab.pdfgen import canvas
-        from reportlab.lib.utils import ImageReader
-        from django.http import HttpResponse
 
         try:
-            import barcode
-            from barcode.writer import ImageWriter
+            import barcode  # noqa: F401
+            import reportlab  # noqa: F401
         except ImportError:
             messages.error(request, 'Barcode library not installed. Please install python-barcode.')
             return redirect('barcode_generator')
@@ -336,89 +458,18 @@ class BarcodeGeneratePDFView(CashierRequiredMixin, View):
             return redirect('barcode_generator')
 
         barcode_mode = request.POST.get('barcode_mode', 'single')
-        
-        variants = ProductVariant.objects.filter(id__in=variant_ids).select_related('product')
-        
-        barcodes_to_generate = []
-        for variant in variants:
-            if barcode_mode == 'quantity':
-                quantity = variant.initial_quantity
-                for i in range(max(1, quantity)):                                  
-                    barcodes_to_generate.append(variant)
-            else:
-                barcodes_to_generate.append(variant)
-        
+        labels = label_variants(variant_ids, barcode_mode)
+
+        if len(labels) > INLINE_LABELS:
+            job = jobs.enqueue(BackgroundJob.Kind.BARCODE_PDF, {
+                'variants': [int(pk) for pk in variant_ids if pk.isdigit()],
+                'barcode_mode': barcode_mode,
+            }, request.user)
+            messages.info(request, f'{len(labels)} labels are being generated in the background.')
+            return redirect('job_detail', pk=job.pk)
+
         buffer = io.BytesIO()
-        p = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-        
-        barcode_width = 60 * mm
-        barcode_height = 25 * mm
-        label_height = 40 * mm                               
-        margin_x = 15 * mm
-        margin_y = 15 * mm
-        spacing_x = 5 * mm
-        spacing_y = 8 * mm
-        
-        cols = 3
-        col = 0
-        row = 0
-        max_rows = int((height - 2 * margin_y) / (label_height + spacing_y))
-        
-        def draw_barcode(p, variant, x, y):
-            """Helper function to draw a single barcode"""
-            try:
-                CODE128 = barcode.get_barcode_class('code128')
-                code = CODE128(variant.sku, writer=ImageWriter())
-                barcode_buffer = io.BytesIO()
-                code.write(barcode_buffer, options={
-                    'module_width': 0.3,
-                    'module_height': 8,
-                    'font_size': 0,
-                    'text_distance': 1,
-                    'quiet_zone': 2,
-                })
-                barcode_buffer.seek(0)
-                barcode_img = ImageReader(barcode_buffer)
-                
-                product_name = f"{variant.product.brand} {variant.product.name}"
-                if len(product_name) > 28:
-                    product_name = product_name[:25] + "..."
-                
-                p.setFont("Helvetica-Bold", 8)
-                p.drawString(x, y + label_height - 8, product_name)
-                
-                variant_info = f"{variant.color or ''} / {variant.size or ''}"
-                p.setFont("Helvetica", 7)
-                p.drawString(x, y + label_height - 18, variant_info.strip(' /'))
-                
-                p.drawImage(barcode_img, x, y + 8, width=barcode_width, height=barcode_height - 5, preserveAspectRatio=True)
-                
-                p.setFont("Helvetica", 8)
-                p.drawCentredString(x + barcode_width / 2, y, variant.sku)
-                
-            except Exception as e:
-                p.setFont("Helvetica-Bold", 9)
-                product_display = f"{variant.product.brand} {variant.product.name}"[:30]
-                p.drawString(x, y + 20, product_display)
-                p.setFont("Helvetica", 8)
-                p.drawString(x, y + 8, f"SKU: {variant.sku}")
-        
-        for variant in barcodes_to_generate:
-            x = margin_x + col * (barcode_width + spacing_x)
-            y = height - margin_y - (row + 1) * (label_height + spacing_y)
-            
-            draw_barcode(p, variant, x, y)
-            
-            col += 1
-            if col >= cols:
-                col = 0
-                row += 1
-                if row >= max_rows:
-                    p.showPage()
-                    row = 0
-        
-        p.save()
+        write_labels_pdf(buffer, labels)
         buffer.seek(0)
         
         response = HttpResponse(buffer, content_type='application/pdf')
@@ -834,17 +885,11 @@ class ClientListView(SalesAssociateRequiredMixin, ListView):
     paginate_by = 20
 
     def get_queryset(self):
-        queryset = super().get_queryset().order_by('first_name', 'last_name')
+        queryset = super().get_queryset().select_related('stats').order_by('first_name', 'last_name')
         
         q = self.request.GET.get('q', '').strip()
         if q:
-            queryset = queryset.filter(
-                Q(first_name__icontains=q) |
-                Q(last_name__icontains=q) |
-                Q(phone__icontains=q) |
-                Q(phone__endswith=q) |                 
-                Q(email__icontains=q)
-            ).distinct()
+            queryset = search_clients(q, queryset)
         
         return queryset
 
@@ -867,9 +912,48 @@ class ClientUpdateView(CashierRequiredMixin, UpdateView):
 
 class ClientDetailView(SalesAssociateRequiredMixin, DetailView):
     model = Client
+    queryset = Client.objects.select_related('stats')
     template_name = 'core/client_detail.html'
     context_object_name = 'client'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        cursor = self.request.GET.get('cursor')
+        orders, next_cursor = purchase_history(self.object, cursor)
+        context.update({
+            'orders': orders,
+            'next_cursor': next_cursor,
+            'is_first_page': not cursor,
+            'totals': lifetime_totals(self.object),
+        })
+        return context
+
+class ClientHistoryView(SalesAssociateRequiredMixin, View):
+    """Purchase history as JSON, newest first, paged with ?cursor="""
+    max_limit = 100
+
+    def get(self, request, pk):
+        client = get_object_or_404(Client, pk=pk)
+        try:
+            limit = min(int(request.GET.get('limit', HISTORY_PAGE_SIZE)), self.max_limit)
+        except ValueError:
+            limit = HISTORY_PAGE_SIZE
+        orders, next_cursor = purchase_history(client, request.GET.get('cursor'), max(limit, 1))
+        data = {
+            'results': [history_row(order) for order in orders],
+            'next_cursor': next_cursor,
+        }
+        if not request.GET.get('cursor'):
+            totals = lifetime_totals(client)
+            data['totals'] = {
+                'orders': totals['orders'],
+                'completed_orders': totals['completed_orders'],
+                'completed_spend': float(totals['completed_spend']),
+                'first_order': totals['first_order'].isoformat() if totals['first_order'] else None,
+                'last_order': totals['last_order'].isoformat() if totals['last_order'] else None,
+            }
+        return JsonResponse(data)
+
 class CashierOnlyMixin(LoginRequiredMixin):
     def dispatch(self, request, *args, **kwargs):
         if not request.user.is_authenticated or not request.user.is_sales_associate():
@@ -877,30 +961,61 @@ class CashierOnlyMixin(LoginRequiredMixin):
         return super().dispatch(request, *args, **kwargs)
 
 class POSView(CashierRequiredMixin, TemplateView):
+    # the variant catalog and the client picker are loaded by the page itself
+    # through pos_catalog / pos_search / pos_client_lookup
     template_name = 'core/pos.html'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        clients = Client.objects.all().order_by('first_name')
-        variants = ProductVariant.objects.select_related('product').all()
-        variant_data = [
-            {
-                'id': v.id,
-                'sku': v.sku,
-                'name': f"{v.product.brand} {v.product.name}",
-                'color': v.color,
-                'size': v.size,
-                'price': float(v.retail_price),
-                'stock': v.initial_quantity,                         
-                'image': v.product.image.url if v.product.image else '',
-            }
-            for v in variants
-        ]
-        context.update({
-            'clients': clients,
-            'variant_data': variant_data,
-        })
-        return context
+
+@method_decorator(gzip_page, name='dispatch')
+class POSCatalogView(CashierOnlyMixin, View):
+    """
+    Catalog sync for POS terminals. Without ``since`` it returns a full
+    snapshot, otherwise only what changed after that cursor. The cursor is
+    also the ETag, so an unchanged catalog costs a 304.
+    """
+    def get(self, request):
+        version = catalog_version()
+        etag = f'"{version}"'
+        since_param = request.GET.get('since')
+        # gzip turns the ETag into a weak one, so compare without the W/ prefix
+        client_etag = request.headers.get('If-None-Match', '').removeprefix('W/')
+        if client_etag == etag or since_param == version:
+            response = HttpResponseNotModified()
+        else:
+            payload = catalog_payload(since=decode_cursor(since_param))
+            response = JsonResponse(payload)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class POSSearchView(CashierOnlyMixin, View):
+    """Typeahead for the POS product box: SKU, brand or name prefix"""
+    max_limit = 50
+
+    def get(self, request):
+        query = request.GET.get('q', '').strip()
+        try:
+            limit = min(int(request.GET.get('limit', 20)), self.max_limit)
+        except ValueError:
+            limit = 20
+        if not query or limit <= 0:
+            return JsonResponse({'results': []})
+        return JsonResponse({'results': search_variants(query, limit=limit)})
+
+
+class POSClientLookupView(CashierOnlyMixin, View):
+    """Customer picker lookup: phone digits (usually the last four), name or email prefix"""
+    max_limit = 20
+
+    def get(self, request):
+        try:
+            limit = min(int(request.GET.get('limit', 10)), self.max_limit)
+        except ValueError:
+            limit = 10
+        clients = search_clients(request.GET.get('q', ''), Client.objects.select_related('stats'))
+        clients = clients.order_by('first_name_key', 'last_name_key', 'id')[:max(limit, 0)]
+        return JsonResponse({'results': [client_row(client) for client in clients]})
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -922,71 +1037,39 @@ class POSPreviewDiscountView(CashierOnlyMixin, View):
         client_obj = None
         if client_id:
             try:
-                client_obj = Client.objects.get(id=client_id)
+                client_obj = Client.objects.select_related('stats').get(id=client_id)
             except Client.DoesNotExist:
                 pass
         
-        cart_items = []
+        try:
+            cart_lines = parse_cart_lines(items)
+        except InvalidCart as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        products = {
+            row['sku']: row
+            for row in ProductVariant.objects.filter(sku__in={sku for sku, _, _ in cart_lines})
+            .values('sku', 'product_id', 'product__brand', 'product__category')
+        }
+        lines = []
         subtotal = Decimal('0.00')
-        for item in items:
-            sku = item.get('sku')
-            qty = int(item.get('qty') or 0)
-            price = Decimal(str(item.get('price') or '0'))
-            if not sku or qty <= 0:
-                continue
-            try:
-                variant = ProductVariant.objects.select_related('product').get(sku=sku)
-                cart_items.append({
-                    'sku': sku,
-                    'qty': qty,
-                    'price': float(price),
-                    'total': float(price * qty),
-                    'product': variant.product,
-                })
-                subtotal += price * qty
-            except ProductVariant.DoesNotExist:
+        for sku, qty, price in cart_lines:
+            row = products.get(sku)
+            if row is None:
                 continue
+            lines.append(PromoLine(row['product_id'], row['product__brand'], row['product__category'], price, qty))
+            subtotal += price * qty
         
-        if not cart_items:
+        if not lines:
             return JsonResponse({'discount': 0, 'description': ''})
         
-        best_discount = Decimal('0.00')
-        best_desc = ''
-        
-        if promo_code:
-            try:
-                code_promo = Promotion.objects.get(
-                    code__iexact=promo_code,
-                    is_active=True,
-                    start_date__lte=timezone.now(),
-                    end_date__gte=timezone.now()
-                )
-                if code_promo.max_uses == 0 or code_promo.used_count < code_promo.max_uses:
-                    promo_amount, promo_desc = code_promo.calculate_discount(cart_items, client_obj)
-                    if promo_amount > 0:
-                        best_discount = promo_amount
-                        best_desc = f"{code_promo.name}: {promo_desc}"
-            except Promotion.DoesNotExist:
-                return JsonResponse({
-                    'discount': 0, 
-                    'description': '',
-                    'error': 'Invalid promo code'
-                })
-        
-        if best_discount == 0:
-            active_promos = Promotion.objects.filter(
-                is_active=True,
-                start_date__lte=timezone.now(),
-                end_date__gte=timezone.now(),
-            ).filter(Q(code__isnull=True) | Q(code=''))
-            
-            for promo in active_promos:
-                if promo.max_uses > 0 and promo.used_count >= promo.max_uses:
-                    continue
-                promo_amount, promo_desc = promo.calculate_discount(cart_items, client_obj)
-                if promo_amount > best_discount:
-                    best_discount = promo_amount
-                    best_desc = f"{promo.name}: {promo_desc}"
+        promo, best_discount, desc, code_found = current_promotions().best_for(lines, client_obj, promo_code)
+        if not code_found:
+            return JsonResponse({
+                'discount': 0, 
+                'description': '',
+                'error': 'Invalid promo code'
+            })
+        best_desc = f"{promo.name}: {desc}" if promo else ''
         
         return JsonResponse({
             'discount': float(best_discount),
@@ -995,210 +1078,355 @@ class POSPreviewDiscountView(CashierOnlyMixin, View):
             'total': float(subtotal - best_discount)
         })
 
+class InvalidCart(ValueError):
+    """A POS cart payload that can't be read; the message says which value is wrong"""
+
+
+def parse_amount(value, label):
+    try:
+        amount = Decimal(str(value or '0'))
+    except InvalidOperation:
+        amount = None
+    if amount is None or not amount.is_finite():
+        raise InvalidCart(f'Invalid {label}: {value}')
+    return amount
+
+
+def parse_cart_lines(items):
+    """
+    Turns POS cart payload items into (sku, qty, price) tuples, skipping
+    empty lines. Raises InvalidCart for a payload it can't read.
+    """
+    if not isinstance(items, list):
+        raise InvalidCart('Items must be a list')
+    lines = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise InvalidCart('Each item must be an object')
+        sku = item.get('sku')
+        try:
+            qty = int(item.get('qty') or 0)
+        except (TypeError, ValueError):
+            raise InvalidCart(f'Invalid quantity for {sku}: {item.get("qty")}')
+        if not sku or qty <= 0:
+            continue
+        lines.append((str(sku), qty, parse_amount(item.get('price'), f'price for {sku}')))
+    return lines
+
+
+class InsufficientStock(Exception):
+    """Raised by deduct_stock; ``lines`` holds one dict per short variant"""
+    def __init__(self, lines):
+        self.lines = lines
+        first = lines[0]
+        super().__init__(
+            f"Insufficient stock for {first['name']} ({first['variant']}). "
+            f"Only {first['available']} available, but {first['requested']} requested."
+        )
+
+
+def deduct_stock(quantities):
+    """
+    Decrements stock for {variant_id: qty} in a single conditional UPDATE.
+    A row is only touched when it still has enough stock, so two terminals
+    selling the last unit can't both succeed. If any variant is short the
+    caller's transaction must roll back; InsufficientStock says which ones.
+    Also bumps updated_at so POS catalogs pick up the new stock.
+    """
+    if not quantities:
+        return
+    enough = Q()
+    for variant_id, qty in quantities.items():
+        enough |= Q(id=variant_id, initial_quantity__gte=qty)
+    updated = ProductVariant.objects.filter(enough).update(
+        initial_quantity=Case(
+            *[When(id=variant_id, then=F('initial_quantity') - qty) for variant_id, qty in quantities.items()],
+            default=F('initial_quantity'),
+            output_field=PositiveIntegerField(),
+        ),
+        updated_at=timezone.now(),
+    )
+    if updated == len(quantities):
+        return
+    short = []
+    for variant in ProductVariant.objects.select_related('product').filter(id__in=quantities.keys()):
+        requested = quantities[variant.id]
+        if variant.initial_quantity < requested:
+            short.append({
+                'sku': variant.sku,
+                'name': f"{variant.product.brand} {variant.product.name}",
+                'variant': f"{variant.color}/{variant.size}" if variant.color or variant.size else "variant",
+                'requested': requested,
+                'available': variant.initial_quantity,
+            })
+    raise InsufficientStock(short)
+
+
+def process_checkout(user, payload):
+    """
+    Runs one POS sale. Returns (status_code, response_data) so the single
+    and the batch checkout endpoints can share it.
+    """
+    items = payload.get('items') or []
+    client_name = payload.get('client') or ''
+    client_id = payload.get('client_id')
+    promo_code = str(payload['promo_code']).strip().upper() if payload.get('promo_code') else None
+    client_obj = None
+    if client_id:
+        try:
+            client_obj = Client.objects.select_related('stats').get(id=client_id)
+            client_name = f"{client_obj.first_name} {client_obj.last_name}".strip() or client_obj.phone or client_name
+        except (Client.DoesNotExist, TypeError, ValueError):
+            client_obj = None
+    if not items:
+        return 400, {'error': 'No items provided'}
+    
+    try:
+        lines = parse_cart_lines(items)
+        discount = parse_amount(payload.get('discount'), 'discount')
+    except InvalidCart as e:
+        return 400, {'error': str(e)}
+    variants = ProductVariant.objects.select_related('product').in_bulk(
+        {sku for sku, _, _ in lines}, field_name='sku'
+    )
+    requested = {}
+    for sku, qty, _ in lines:
+        if sku not in variants:
+            return 400, {'error': f'Product with SKU {sku} not found'}
+        requested[sku] = requested.get(sku, 0) + qty
+    
+    location = Location.objects.first()
+    if not location:
+        location = Location.objects.create(name='Main Warehouse', code='MAIN', address='N/A')
+    
+    try:
+        with transaction.atomic():
+            order, created_items, total = create_sale_order(
+                user, lines, variants, requested, client_obj, location, discount, promo_code
+            )
+    except InsufficientStock as e:
+        return 400, {'error': str(e), 'insufficient_stock': e.lines}
+    
+    response_items = [
+        {k: v for k, v in item.items() if k != 'product'}
+        for item in created_items
+    ]
+    
+    return 200, {
+        'order_id': order.id,
+        'order_code': order.order_code,
+        'client': client_name or 'Walk-in',
+        'cashier': user.username,
+        'total': float(order.total_amount),
+        'discount': float(order.total_discount),
+        'subtotal': float(total),
+        'items': response_items,
+        'created_at': timezone.localtime(order.created_at).isoformat(),
+    }
+
+
+def process_checkout_once(user, payload, key):
+    """
+    process_checkout guarded by a client-generated idempotency key.
+    A key that already produced a sale returns the stored result instead of
+    selling again. Returns (status_code, response_data, replayed).
+    """
+    if not key:
+        status, data = process_checkout(user, payload)
+        return status, data, False
+    stored = CheckoutIdempotencyKey.objects.filter(key=key).first()
+    if stored:
+        return stored.status_code, stored.response, True
+    try:
+        with transaction.atomic():
+            status, data = process_checkout(user, payload)
+            if status == 200:
+                # failed checkouts wrote nothing, so only successes are remembered
+                CheckoutIdempotencyKey.objects.create(
+                    key=key,
+                    order_id=data['order_id'],
+                    status_code=status,
+                    response=data,
+                    created_by=user,
+                )
+    except IntegrityError:
+        # a concurrent retry with the same key won; ours was rolled back
+        stored = CheckoutIdempotencyKey.objects.filter(key=key).first()
+        if stored is None:
+            raise
+        return stored.status_code, stored.response, True
+    return status, data, False
+
+
+def get_idempotency_key(request, payload):
+    key = request.headers.get('Idempotency-Key') or payload.get('idempotency_key') or ''
+    return str(key).strip()[:64]
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class POSCheckoutView(CashierOnlyMixin, View):
     """Create an order from POS items and return order details for receipt"""
-    def _generate_code(self):
-        while True:
-            code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-            if not Order.objects.filter(order_code=code).exists():
-                return code
-
     def post(self, request):
-        import json
         try:
             payload = json.loads(request.body.decode('utf-8'))
         except Exception:
-            return HttpResponseBadRequest("Invalid payload")
+            return JsonResponse({'error': 'Invalid payload'}, status=400)
+        if not isinstance(payload, dict):
+            return JsonResponse({'error': 'Invalid payload'}, status=400)
         
-        items = payload.get('items') or []
-        client_name = payload.get('client') or ''
-        client_id = payload.get('client_id')
-        promo_code = payload.get('promo_code', '').strip().upper() if payload.get('promo_code') else None
-        client_obj = None
-        if client_id:
-            try:
-                client_obj = Client.objects.get(id=client_id)
-                client_name = f"{client_obj.first_name} {client_obj.last_name}".strip() or client_obj.phone or client_name
-            except Client.DoesNotExist:
-                client_obj = None
-        discount = Decimal(payload.get('discount') or 0)
-        if not items:
-            return HttpResponseBadRequest("No items provided")
+        status, data, _ = process_checkout_once(request.user, payload, get_idempotency_key(request, payload))
+        return JsonResponse(data, status=status)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class POSBatchCheckoutView(CashierOnlyMixin, View):
+    """
+    Flushes sales a terminal queued while offline. Every cart needs an
+    idempotency_key; carts run in their own transaction so one bad cart
+    doesn't sink the rest, and replays return the original result.
+    """
+    max_carts = 100
+
+    def post(self, request):
+        try:
+            payload = json.loads(request.body.decode('utf-8'))
+        except Exception:
+            return JsonResponse({'error': 'Invalid payload'}, status=400)
+        if not isinstance(payload, dict):
+            return JsonResponse({'error': 'Invalid payload'}, status=400)
         
-        for item in items:
-            sku = item.get('sku')
-            qty = int(item.get('qty') or 0)
-            if not sku or qty <= 0:
-                continue
-            try:
-                variant = ProductVariant.objects.get(sku=sku)
-                if variant.initial_quantity < qty:
-                    product_name = f"{variant.product.brand} {variant.product.name}"
-                    variant_desc = f"{variant.color}/{variant.size}" if variant.color or variant.size else "variant"
-                    return JsonResponse({
-                        'error': f'Insufficient stock for {product_name} ({variant_desc}). Only {variant.initial_quantity} available, but {qty} requested.'
-                    }, status=400)
-            except ProductVariant.DoesNotExist:
-                return JsonResponse({'error': f'Product with SKU {sku} not found'}, status=400)
+        carts = payload.get('carts') or []
+        if not isinstance(carts, list) or not carts:
+            return JsonResponse({'error': 'No carts provided'}, status=400)
+        if len(carts) > self.max_carts:
+            return JsonResponse({'error': f'At most {self.max_carts} carts per batch'}, status=400)
         
-        location = Location.objects.first()
-        if not location:
-            location = Location.objects.create(name='Main Warehouse', code='MAIN', address='N/A')
+        keys = [get_idempotency_key(request, cart) if isinstance(cart, dict) else '' for cart in carts]
+        stored = CheckoutIdempotencyKey.objects.in_bulk([k for k in keys if k], field_name='key')
         
-        with transaction.atomic():
-            order = Order.objects.create(
-                order_code=self._generate_code(),
+        results = []
+        for cart, key in zip(carts, keys):
+            if not key:
+                results.append({'idempotency_key': None, 'status': 400, 'replayed': False,
+                                'result': {'error': 'idempotency_key is required'}})
+                continue
+            if key in stored:
+                status, data, replayed = stored[key].status_code, stored[key].response, True
+            else:
+                status, data, replayed = process_checkout_once(request.user, cart, key)
+            results.append({'idempotency_key': key, 'status': status, 'replayed': replayed, 'result': data})
+        
+        return JsonResponse({'results': results})
+
+def create_sale_order(user, lines, variants, requested, client_obj, location, discount, promo_code):
+    # stock goes first so a short line fails before anything else is written
+    deduct_stock({variants[sku].id: qty for sku, qty in requested.items()})
+    order = Order.objects.create(
+        client=client_obj,
+        location=location,
+        created_by=user,
+        status=Order.Status.COMPLETED,
+        total_amount=Decimal('0.00'),
+        total_discount=discount,
+    )
+    total = Decimal('0.00')
+    order_items = []
+    created_items = []
+    promo_cart = []
+    for sku, qty, price in lines:
+        variant = variants[sku]
+        line_total = price * qty
+        total += line_total
+        promo_cart.append(PromoLine(variant.product_id, variant.product.brand, variant.product.category, price, qty))
+        order_items.append(OrderItem(
+            order=order,
+            variant=variant,
+            quantity=qty,
+            unit_price=price,
+            unit_cost=variant.cost_price,
+            line_discount=Decimal('0.00'),
+        ))
+        created_items.append({
+            'name': f"{variant.product.brand} {variant.product.name}",
+            'sku': variant.sku,
+            'color': variant.color,
+            'size': variant.size,
+            'qty': qty,
+            'price': float(price),
+            'total': float(line_total),
+            'product': variant.product,                             
+        })
+    OrderItem.objects.bulk_create(order_items)
+    
+    promo_discount = Decimal('0.00')
+    best_promo, best_discount, _, _ = current_promotions().best_for(promo_cart, client_obj, promo_code)
+    
+    # the compiled set may be a little behind on usage counts, so claim a use atomically
+    if best_promo and best_discount > 0:
+        claimed = Promotion.objects.filter(pk=best_promo.id, is_active=True).filter(
+            Q(max_uses=0) | Q(used_count__lt=F('max_uses'))
+        ).update(used_count=F('used_count') + 1)
+        if claimed:
+            promo_discount = best_discount
+            if best_promo.max_uses:
+                invalidate_promotions()
+            PromotionUsage.objects.create(
+                promotion_id=best_promo.id,
                 client=client_obj,
-                location=location,
-                created_by=request.user,
-                status=Order.Status.COMPLETED,
-                total_amount=Decimal('0.00'),
-                total_discount=discount,
+                order=order,
+                discount_amount=promo_discount
             )
-            total = Decimal('0.00')
-            created_items = []
-            for item in items:
-                sku = item.get('sku')
-                qty = int(item.get('qty') or 0)
-                price = Decimal(str(item.get('price') or '0'))
-                if not sku or qty <= 0:
-                    continue
-                try:
-                    variant = ProductVariant.objects.get(sku=sku)
-                except ProductVariant.DoesNotExist:
-                    continue
-                line_total = price * qty
-                total += line_total
-                oi = OrderItem.objects.create(
-                    order=order,
-                    variant=variant,
-                    quantity=qty,
-                    unit_price=price,
-                    line_discount=Decimal('0.00'),
-                )
-                variant.initial_quantity = max(0, variant.initial_quantity - qty)
-                variant.save(update_fields=['initial_quantity'])
-                created_items.append({
-                    'name': f"{variant.product.brand} {variant.product.name}",
-                    'sku': variant.sku,
-                    'color': variant.color,
-                    'size': variant.size,
-                    'qty': qty,
-                    'price': float(price),
-                    'total': float(line_total),
-                    'product': variant.product,                             
-                })
-            
-            promo_discount = Decimal('0.00')
-            promo_description = ''
-            
-            best_discount = Decimal('0.00')
-            best_promo = None
-            best_desc = ''
-            
-            if promo_code:
-                try:
-                    code_promo = Promotion.objects.get(
-                        code__iexact=promo_code,
-                        is_active=True,
-                        start_date__lte=timezone.now(),
-                        end_date__gte=timezone.now()
-                    )
-                    if code_promo.max_uses == 0 or code_promo.used_count < code_promo.max_uses:
-                        promo_amount, promo_desc = code_promo.calculate_discount(created_items, client_obj)
-                        if promo_amount > 0:
-                            best_discount = promo_amount
-                            best_promo = code_promo
-                            best_desc = promo_desc
-                except Promotion.DoesNotExist:
-                    pass                                                
-            
-            if not best_promo:
-                active_promos = Promotion.objects.filter(
-                    is_active=True,
-                    start_date__lte=timezone.now(),
-                    end_date__gte=timezone.now(),
-                    code__isnull=True                                        
-                ) | Promotion.objects.filter(
-                    is_active=True,
-                    start_date__lte=timezone.now(),
-                    end_date__gte=timezone.now(),
-                    code=''
-                )
-                
-                for promo in active_promos:
-                    if promo.max_uses > 0 and promo.used_count >= promo.max_uses:
-                        continue
-                    promo_amount, promo_desc = promo.calculate_discount(created_items, client_obj)
-                    if promo_amount > best_discount:
-                        best_discount = promo_amount
-                        best_promo = promo
-                        best_desc = promo_desc
-            
-            if best_promo and best_discount > 0:
-                promo_discount = best_discount
-                promo_description = f"{best_promo.name}: {best_desc}"
-                best_promo.used_count += 1
-                best_promo.save(update_fields=['used_count'])
-                PromotionUsage.objects.create(
-                    promotion=best_promo,
-                    client=client_obj,
-                    order=order,
-                    discount_amount=promo_discount
-                )
-            
-            total_discount = discount + promo_discount
-            order.total_amount = total - total_discount
-            order.total_discount = total_discount
-            order.save(update_fields=['total_amount', 'total_discount'])
-        
-        response_items = [
-            {k: v for k, v in item.items() if k != 'product'}
-            for item in created_items
-        ]
-        
-        return JsonResponse({
-            'order_id': order.id,
-            'order_code': order.order_code,
-            'client': client_name or 'Walk-in',
-            'cashier': request.user.username,
-            'total': float(order.total_amount),
-            'discount': float(order.total_discount),
-            'subtotal': float(total),
-            'items': response_items,
-            'created_at': timezone.localtime(order.created_at).isoformat(),
-        })
+    
+    total_discount = discount + promo_discount
+    order.order_code = order_code_for(order.id)
+    order.total_amount = total - total_discount
+    order.total_discount = total_discount
+    order.save(update_fields=['order_code', 'total_amount', 'total_discount'])
+    ClientStats.record(order.client_id, 1, order.total_amount)
+    rollups.record_sale(order, [
+        (variants[sku].product, qty, price, variants[sku].cost_price) for sku, qty, price in lines
+    ])
+    dashboard_changed(*dashboard_cache.SALE_FRAGMENTS)
+    publish_sale(order, sum(requested.values()))
+    publish_low_stock(
+        [variants[sku] for sku in requested],
+        {variants[sku].id: qty for sku, qty in requested.items()},
+    )
+    return order, created_items, total
 
 def calculate_order_return_status(order):
     """
     Calculate if SALE/EXCHANGE order is COMPLETED, PARTIALLY_RETURNED, or FULLY_RETURNED
-    based on item-level qty_returned tracking
+    based on item-level qty_returned tracking, in one aggregate over its lines
     """
     if order.type not in [Order.Type.SALE, Order.Type.EXCHANGE]:
         return order.status
     
-    items = order.items.all()
-    if not items:
+    lines = order.items.aggregate(
+        lines=Count('id'),
+        open_lines=Count('id', filter=Q(qty_returned__lt=F('quantity'))),
+        returned=Sum('qty_returned'),
+    )
+    if not lines['lines']:
         return Order.Status.COMPLETED
     
-    all_fully_returned = all(item.is_fully_returned for item in items)
-    any_partially_returned = any(item.qty_returned > 0 for item in items)
-    
-    if all_fully_returned:
+    if lines['open_lines'] == 0:
         return Order.Status.FULLY_RETURNED
-    elif any_partially_returned:
+    elif lines['returned']:
         return Order.Status.PARTIALLY_RETURNED
     else:
         return Order.Status.COMPLETED
 
+class ReturnRejected(Exception):
+    """A return/exchange request that can't be processed as asked; the message is shown to the cashier"""
+
 @method_decorator(csrf_exempt, name='dispatch')
 class POSReturnLookupView(CashierOnlyMixin, View):
     def post(self, request):
         import json
         try:
             payload = json.loads(request.body.decode('utf-8'))
-            code = payload.get('order_code', '').strip().upper().replace('#', '')
+            code = normalize_order_code(payload.get('order_code', ''))
         except Exception:
             return JsonResponse({'error': 'Invalid payload'}, status=400)
         if not code:
@@ -1282,12 +1510,6 @@ class POSReturnLookupView(CashierOnlyMixin, View):
 
 @method_decorator(csrf_exempt, name='dispatch')
 class POSReturnCheckoutView(CashierRequiredMixin, View):
-    def _gen_code(self):
-        while True:
-            code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-            if not Order.objects.filter(order_code=code).exists():
-                return code
-
     def post(self, request):
         import json
         try:
@@ -1295,7 +1517,7 @@ class POSReturnCheckoutView(CashierRequiredMixin, View):
         except Exception as e:
             return JsonResponse({'error': f'Invalid payload: {str(e)}'}, status=400)
 
-        order_code = payload.get('order_code')
+        order_code = normalize_order_code(payload.get('order_code'))
         reason = payload.get('reason', 'OTHER')
         action = payload.get('action', 'REFUND')
         return_items = payload.get('return_items') or []
@@ -1305,11 +1527,11 @@ class POSReturnCheckoutView(CashierRequiredMixin, View):
             return JsonResponse({'error': 'Order code is required'}, status=400)
 
         try:
-            original_order = Order.objects.get(order_code=order_code)
+            original_order = Order.objects.select_related('location', 'client').get(order_code=order_code)
         except Order.DoesNotExist:
             if order_code.isdigit():
                 try:
-                    original_order = Order.objects.get(id=int(order_code))
+                    original_order = Order.objects.select_related('location', 'client').get(id=int(order_code))
                 except Order.DoesNotExist:
                     return JsonResponse({'error': f'Order not found: {order_code}'}, status=404)
             else:
@@ -1319,98 +1541,114 @@ class POSReturnCheckoutView(CashierRequiredMixin, View):
         client_obj = original_order.client
 
         try:
+            requested = {}
+            for item in return_items:
+                qty = int(item.get('qty') or 0)
+                if qty > 0 and item.get('id'):
+                    order_item_id = int(item.get('id'))
+                    requested[order_item_id] = requested.get(order_item_id, 0) + qty
+            replacement_lines = parse_cart_lines(replacement_items)
+
             with transaction.atomic():
-                return_obj = Return.objects.create(
-                    original_order=original_order,
-                    created_by=request.user,
-                    reason=reason,
-                    action=action
+                # lock the order, then its lines, so two returns on the same order are applied one
+                # after the other and the status change below is made from the current status
+                original_order = (
+                    Order.objects.select_for_update(of=('self',)).select_related('location', 'client')
+                    .get(pk=original_order.pk)
                 )
-
-                refund_amount = Decimal('0.00')
-                
-                returned_map = {}
-                for ret in original_order.returns.all():
-                    for ri in ret.items.all():
-                        returned_map[ri.order_item_id] = returned_map.get(ri.order_item_id, 0) + ri.quantity
-
-                for item in replacement_items:
-                    sku = item.get('sku')
-                    qty = int(item.get('qty') or 0)
-                    if not sku or qty <= 0:
-                        continue
-                    try:
-                        variant = ProductVariant.objects.get(sku=sku)
-                        if variant.initial_quantity < qty:
-                            product_name = f"{variant.product.brand} {variant.product.name}"
-                            variant_desc = f"{variant.color}/{variant.size}" if variant.color or variant.size else "variant"
-                            return JsonResponse({
-                                'error': f'Insufficient stock for exchange item: {product_name} ({variant_desc}). Only {variant.initial_quantity} available, but {qty} requested.'
-                            }, status=400)
-                    except ProductVariant.DoesNotExist:
-                        return JsonResponse({'error': f'Product with SKU {sku} not found'}, status=400)
-
-                for item in return_items:
-                    order_item_id = item.get('id')
-                    qty = int(item.get('qty') or 0)
-                    if qty <= 0:
-                        continue
-                    
-                    try:
-                        order_item = OrderItem.objects.get(id=order_item_id, order=original_order)
-                    except OrderItem.DoesNotExist:
+                order_items = {
+                    oi.id: oi
+                    for oi in OrderItem.objects.select_for_update(of=('self',))
+                    .select_related('variant__product')
+                    .filter(order=original_order)
+                }
+                returned = []
+                for order_item_id, qty in requested.items():
+                    order_item = order_items.get(order_item_id)
+                    if order_item is None:
                         continue
-                    
                     if qty > order_item.qty_remaining:
                         raise Exception(f"Cannot return {qty} of {order_item.variant}. Only {order_item.qty_remaining} remaining (already returned {order_item.qty_returned}).")
+                    returned.append((order_item, qty))
 
-                    ReturnItem.objects.create(
-                        return_process=return_obj,
-                        order_item=order_item,
-                        quantity=qty,
-                        reason=reason
+                replacement_variants = ProductVariant.objects.select_related('product').in_bulk(
+                    {sku for sku, _, _ in replacement_lines}, field_name='sku'
+                )
+                replacement_qty = {}
+                for sku, qty, _ in replacement_lines:
+                    if sku not in replacement_variants:
+                        raise ReturnRejected(f'Product with SKU {sku} not found')
+                    variant_id = replacement_variants[sku].id
+                    replacement_qty[variant_id] = replacement_qty.get(variant_id, 0) + qty
+                try:
+                    deduct_stock(replacement_qty)
+                except InsufficientStock as e:
+                    short = e.lines[0]
+                    raise ReturnRejected(
+                        f"Insufficient stock for exchange item: {short['name']} ({short['variant']}). "
+                        f"Only {short['available']} available, but {short['requested']} requested."
                     )
 
-                    order_item.qty_returned = F('qty_returned') + qty
-                    order_item.save(update_fields=['qty_returned'])
-                    order_item.refresh_from_db()                     
-
-                    variant = order_item.variant
-                    variant.initial_quantity = variant.initial_quantity + qty
-                    variant.save(update_fields=['initial_quantity'])
-
+                refund_amount = Decimal('0.00')
+                refund_cost = Decimal('0.00')
+                return_item_rows = []
+                restock = {}
+                for order_item, qty in returned:
+                    unit_cost = order_item.unit_cost
+                    if unit_cost is None:
+                        unit_cost = order_item.variant.cost_price or Decimal('0.00')
                     refund_amount += order_item.unit_price * qty
+                    refund_cost += unit_cost * qty
+                    restock[order_item.variant_id] = restock.get(order_item.variant_id, 0) + qty
+                    return_item_rows.append(ReturnItem(
+                        order_item=order_item,
+                        quantity=qty,
+                        reason=reason,
+                        unit_price=order_item.unit_price,
+                        unit_cost=unit_cost,
+                    ))
 
-                replacement_total = Decimal('0.00')
-                replacement_lines = []
-                
-                for item in replacement_items:
-                    sku = item.get('sku')
-                    qty = int(item.get('qty') or 0)
-                    price = Decimal(str(item.get('price') or '0'))
-                    if not sku or qty <= 0:
-                        continue
-                    try:
-                        variant = ProductVariant.objects.get(sku=sku)
-                    except ProductVariant.DoesNotExist:
-                        continue
-                    
-                    replacement_total += price * qty
-                    variant.initial_quantity = max(0, variant.initial_quantity - qty)
-                    variant.save(update_fields=['initial_quantity'])
-                    replacement_lines.append({
-                        'variant': variant,
-                        'qty': qty,
-                        'price': price,
-                    })
+                return_obj = Return.objects.create(
+                    original_order=original_order,
+                    created_by=request.user,
+                    reason=reason,
+                    action=action,
+                    refund_amount=refund_amount,
+                    refund_cost=refund_cost,
+                )
 
-                
+                if returned:
+                    for row in return_item_rows:
+                        row.return_process = return_obj
+                    ReturnItem.objects.bulk_create(return_item_rows)
+                    OrderItem.objects.filter(id__in=[order_item.id for order_item, _ in returned]).update(
+                        qty_returned=Case(
+                            *[When(id=order_item.id, then=F('qty_returned') + qty) for order_item, qty in returned],
+                            default=F('qty_returned'),
+                            output_field=PositiveIntegerField(),
+                        )
+                    )
+                    for order_item, qty in returned:
+                        order_item.qty_returned += qty
+                    rollups.record_return(return_obj, original_order.location_id, [
+                        (row.order_item.variant.product, row.quantity, row.unit_price, row.unit_cost)
+                        for row in return_item_rows
+                    ])
+                    ProductVariant.objects.filter(id__in=restock.keys()).update(
+                        initial_quantity=Case(
+                            *[When(id=variant_id, then=F('initial_quantity') + qty) for variant_id, qty in restock.items()],
+                            default=F('initial_quantity'),
+                            output_field=PositiveIntegerField(),
+                        ),
+                        updated_at=timezone.now(),
+                    )
+
+                replacement_total = sum((price * qty for _, qty, price in replacement_lines), Decimal('0.00'))
                 replacement_order = None
                 if replacement_lines:
                     replacement_order = Order.objects.create(
                         type=Order.Type.EXCHANGE,                         
                         parent_order=original_order,                    
-                        order_code=self._gen_code(),
                         client=client_obj,
                         location=location,
                         created_by=request.user,
@@ -1418,50 +1656,70 @@ class POSReturnCheckoutView(CashierRequiredMixin, View):
                         total_amount=replacement_total,
                         total_discount=Decimal('0.00'),
                     )
+                    replacement_order.order_code = order_code_for(replacement_order.id)
+                    replacement_order.save(update_fields=['order_code'])
                     
-                    for line in replacement_lines:
-                        OrderItem.objects.create(
+                    OrderItem.objects.bulk_create([
+                        OrderItem(
                             order=replacement_order,
-                            variant=line['variant'],
-                            quantity=line['qty'],
-                            unit_price=line['price'],
+                            variant=replacement_variants[sku],
+                            quantity=qty,
+                            unit_price=price,
+                            unit_cost=replacement_variants[sku].cost_price,
                             line_discount=Decimal('0.00'),
                         )
+                        for sku, qty, price in replacement_lines
+                    ])
                     
                     return_obj.replacement_order = replacement_order
+                    return_obj.save(update_fields=['replacement_order'])
+                    ClientStats.record(replacement_order.client_id, 1, replacement_order.total_amount)
+                    rollups.record_sale(replacement_order, [
+                        (replacement_variants[sku].product, qty, price, replacement_variants[sku].cost_price)
+                        for sku, qty, price in replacement_lines
+                    ])
                 
-                return_obj.save()
-                
+                dashboard_changed(*dashboard_cache.SALE_FRAGMENTS)
+                events.publish_on_commit('return', {
+                    'date': timezone.localdate(return_obj.created_at),
+                    'location_id': original_order.location_id,
+                    'order_code': original_order.order_code,
+                    'refund_amount': refund_amount,
+                    'kpis': {'refund_amount': refund_amount},
+                })
+                if replacement_order:
+                    publish_sale(replacement_order, sum(replacement_qty.values()))
+                    publish_low_stock(replacement_variants.values(), replacement_qty)
+                old_status = original_order.status
                 original_order.status = calculate_order_return_status(original_order)
-                original_order.save(update_fields=['status'])
-
-                returned_items_list = []
-                for item in return_items:
-                    try:
-                        oi = OrderItem.objects.get(id=item.get('id'))
-                        returned_items_list.append({
-                            'name': f"{oi.variant.product.brand} {oi.variant.product.name}",
-                            'sku': oi.variant.sku,
-                            'color': oi.variant.color or '',
-                            'size': oi.variant.size or '',
-                            'qty': int(item.get('qty')),
-                            'price': float(oi.unit_price),
-                            'total': float(oi.unit_price * int(item.get('qty')))
-                        })
-                    except: 
-                        pass
+                if original_order.status != old_status:
+                    original_order.save(update_fields=['status'])
+                    ClientStats.record_status_change(original_order, old_status)
+
+                returned_items_list = [
+                    {
+                        'name': f"{oi.variant.product.brand} {oi.variant.product.name}",
+                        'sku': oi.variant.sku,
+                        'color': oi.variant.color or '',
+                        'size': oi.variant.size or '',
+                        'qty': qty,
+                        'price': float(oi.unit_price),
+                        'total': float(oi.unit_price * qty)
+                    }
+                    for oi, qty in returned
+                ]
 
                 replacement_items_list = []
-                for line in replacement_lines:
-                    v = line['variant']
+                for sku, qty, price in replacement_lines:
+                    v = replacement_variants[sku]
                     replacement_items_list.append({
                         'name': f"{v.product.brand} {v.product.name}",
                         'sku': v.sku,
                         'color': v.color or '',
                         'size': v.size or '',
-                        'qty': line['qty'],
-                        'price': float(line['price']),
-                        'total': float(line['price'] * line['qty'])
+                        'qty': qty,
+                        'price': float(price),
+                        'total': float(price * qty)
                     })
 
                 net = float(replacement_total) - float(refund_amount)
@@ -1483,6 +1741,8 @@ class POSReturnCheckoutView(CashierRequiredMixin, View):
                     'cashier': request.user.username,
                     'client': str(client_obj) if client_obj else 'Walk-in',
                 })
+        except ReturnRejected as e:
+            return JsonResponse({'error': str(e)}, status=400)
         except Exception as e:
             return JsonResponse({'error': f'Error processing return: {str(e)}'}, status=400)
 
@@ -1491,131 +1751,82 @@ class POSReturnView(CashierRequiredMixin, TemplateView):
 
 class ReportView(OwnerRequiredMixin, TemplateView):
     template_name = 'core/reports.html'
-    
+
     def get_context_data(self, **kwargs):
-        from datetime import timedelta
-        from django.db.models.functions import TruncDate
-        
         context = super().get_context_data(**kwargs)
-        
-        days = int(self.request.GET.get('days', 30))
-        end_date = timezone.now()
-        start_date = end_date - timedelta(days=days)
-        
-        context['selected_days'] = days
-        
-        completed_orders = Order.objects.filter(
-            status=Order.Status.COMPLETED,
-            created_at__range=(start_date, end_date)
-        )
-        
-        refunded_orders = Order.objects.filter(
-            created_at__range=(start_date, end_date)
-        ).filter(Q(status=Order.Status.REFUNDED) | Q(type=Order.Type.RETURN))
-        
-        total_revenue = completed_orders.aggregate(total=Sum('total_amount'))['total'] or Decimal('0')
-
-        total_refunds = Decimal('0')
-        returns_qs = Return.objects.filter(created_at__range=(start_date, end_date)).prefetch_related('items__order_item')
-        for ret in returns_qs:
-            for item in ret.items.all():
-                if item.order_item and item.order_item.unit_price:
-                    total_refunds += item.order_item.unit_price * item.quantity
 
-        net_revenue = total_revenue - total_refunds
-        
-        sales_cost = Decimal('0')
-        for order in completed_orders:
-            for item in order.items.all():
-                if item.variant and item.variant.cost_price:
-                    sales_cost += item.variant.cost_price * item.quantity
-        
-        return_cost = Decimal('0')
-        for ret in returns_qs:
-            for item in ret.items.all():
-                if item.order_item and item.order_item.variant and item.order_item.variant.cost_price:
-                    return_cost += item.order_item.variant.cost_price * item.quantity
-
-        total_cost = sales_cost - return_cost
-        
-        gross_profit = total_revenue - sales_cost
-        gross_margin = (gross_profit / total_revenue * 100) if total_revenue else Decimal('0')
+        period, error = reports.parse_period(self.request.GET)
+        if error:
+            messages.warning(self.request, f"{error} Showing {period.start:%b %d, %Y} - {period.end:%b %d, %Y} instead.")
+
+        location, error = reports.parse_location(self.request.GET)
+        if error:
+            messages.warning(self.request, f"{error} Showing all locations instead.")
+
+        watermark = reports.data_watermark()
+        report = reports.cached_report(period, location, watermark=watermark)
+        compare = self.request.GET.get('compare', '')
+        comparison_period = period.compared_with(compare)
+        if comparison_period:
+            comparison = reports.cached_report(comparison_period, location, watermark=watermark)
+            context.update({
+                'comparison': comparison,
+                'changes': reports.compare_reports(report, comparison),
+                'comparison_revenue': json.dumps(comparison['chart_revenue']),
+                'comparison_labels': json.dumps(comparison['chart_labels']),
+            })
 
-        total_profit = net_revenue - total_cost
-        margin_base = total_revenue if total_revenue > 0 else net_revenue
-        profit_margin = (total_profit / margin_base * 100) if margin_base and margin_base != 0 else Decimal('0')
-        
-        total_orders = completed_orders.count()
-        total_items = OrderItem.objects.filter(order__in=completed_orders).aggregate(total=Sum('quantity'))['total'] or 0
-        avg_order_value = net_revenue / total_orders if total_orders > 0 else Decimal('0')
-        
-        daily_sales = completed_orders.annotate(
-            date=TruncDate('created_at')
-        ).values('date').annotate(
-            revenue=Sum('total_amount'),
-            orders=Count('id')
-        ).order_by('date')
-        
-        chart_labels = []
-        chart_revenue = []
-        chart_orders = []
-        
-        for entry in daily_sales:
-            chart_labels.append(entry['date'].strftime('%b %d'))
-            chart_revenue.append(float(entry['revenue'] or 0))
-            chart_orders.append(entry['orders'])
-        
-        top_products = OrderItem.objects.filter(
-            order__in=completed_orders
-        ).values(
-            'variant__product__name', 
-            'variant__product__brand'
-        ).annotate(
-            total_qty=Sum('quantity'),
-            total_revenue=Sum(F('quantity') * F('unit_price'))
-        ).order_by('-total_revenue')[:10]
-        
-        top_by_qty = OrderItem.objects.filter(
-            order__in=completed_orders
-        ).values(
-            'variant__product__name', 
-            'variant__product__brand'
-        ).annotate(
-            total_qty=Sum('quantity'),
-            total_revenue=Sum(F('quantity') * F('unit_price'))
-        ).order_by('-total_qty')[:10]
-        
-        category_sales = OrderItem.objects.filter(
-            order__in=completed_orders
-        ).values(
-            'variant__product__category'
-        ).annotate(
-            total_revenue=Sum(F('quantity') * F('unit_price'))
-        ).order_by('-total_revenue')
-        
+        context.update(report)
         context.update({
-            'total_revenue': total_revenue,
-            'total_refunds': abs(total_refunds),
-            'net_revenue': net_revenue,
-            'total_cost': total_cost,
-            'total_profit': total_profit,
-            'profit_margin': profit_margin,
-            'gross_profit': gross_profit,
-            'gross_margin': gross_margin,
-            'total_orders': total_orders,
-            'total_items': total_items,
-            'avg_order_value': avg_order_value,
-            'chart_labels': json.dumps(chart_labels),
-            'chart_revenue': json.dumps(chart_revenue),
-            'chart_orders': json.dumps(chart_orders),
-            'top_products': top_products,
-            'top_by_qty': top_by_qty,
-            'category_sales': category_sales,
-            'start_date': start_date,
-            'end_date': end_date,
+            'chart_labels': json.dumps(report['chart_labels']),
+            'chart_revenue': json.dumps(report['chart_revenue']),
+            'chart_orders': json.dumps(report['chart_orders']),
+            'start_date': period.start,
+            'end_date': period.end,
+            'selected_days': period.days if period.end == timezone.localdate() else None,
+            'preset_days': reports.PRESET_DAYS,
+            'compare': compare if comparison_period else '',
+            'compare_choices': reports.COMPARE_CHOICES,
+            'period_query': reports.report_query(period, location),
+            'locations': Location.objects.order_by('name'),
+            'pivot_available': analytics.available(),
+            'pivot_dimensions': analytics.DIMENSIONS,
+            'pivot_measures': analytics.MEASURES,
         })
-        
         return context
+
+
+class ReportPivotView(OwnerRequiredMixin, View):
+    """
+    JSON pivot of sold lines, e.g. ?rows=brand&columns=week&measure=revenue,
+    over the report period (start/end/days as on the report page).
+    Categorical dimensions can also be filtered: ?location=<id>&brand=Gucci.
+    """
+    def get(self, request):
+        if not analytics.available():
+            return JsonResponse({'error': 'Pivot reports require numpy. Install with: pip install numpy'}, status=503)
+        period, error = reports.parse_period(request.GET)
+        if error:
+            return JsonResponse({'error': error}, status=400)
+        try:
+            filters = {
+                dimension: analytics.parse_filter(dimension, request.GET[dimension])
+                for dimension in analytics.CATEGORICAL if request.GET.get(dimension)
+            }
+            limit = request.GET.get('limit')
+            result = analytics.current_cube().pivot(
+                request.GET.get('rows', 'brand'),
+                request.GET.get('columns') or None,
+                measure=request.GET.get('measure', 'revenue'),
+                start=period.start, end=period.end, filters=filters,
+                limit=int(limit) if limit and limit.isdigit() else None,
+            )
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        result.update({'start': period.start.isoformat(), 'end': period.end.isoformat()})
+        return JsonResponse(result)
+
+
 class SalesAssociateDashboardView(SalesAssociateRequiredMixin, TemplateView):
     template_name = 'core/sales_associate_dashboard.html'
     
@@ -1802,115 +2013,92 @@ class PersonnelDeleteView(OwnerRequiredMixin, View):
 
 
 from django.http import HttpResponse
-from datetime import timedelta
 from django.db.models import Count, Avg
-from django.db.models.functions import TruncDate
 
 class ReportExportView(OwnerRequiredMixin, View):
+    """Excel (default), CSV or NDJSON export of a report period, streamed back"""
     def get(self, request):
-        try:
-            from openpyxl import Workbook
-            from openpyxl.styles import Font, Alignment, PatternFill
-        except ImportError:
-            messages.error(request, "Excel export requires openpyxl. Install with: pip install openpyxl")
+        period, error = reports.parse_period(request.GET)
+        if error:
+            messages.error(request, error)
             return redirect('reports')
-        
-        days = int(request.GET.get('days', 30))
-        end_date = timezone.now()
-        start_date = end_date - timedelta(days=days)
-        
-        orders = Order.objects.filter(
-            status=Order.Status.COMPLETED,
-            created_at__range=(start_date, end_date)
-        ).order_by('-created_at')
-        
-        wb = Workbook()
-        
-        ws = wb.active
-        ws.title = "Summary"
-        
-        total_revenue = orders.aggregate(total=Sum('total_amount'))['total'] or Decimal('0')
-        total_orders = orders.count()
-        avg_order = total_revenue / total_orders if total_orders > 0 else Decimal('0')
-        total_items = OrderItem.objects.filter(order__in=orders).aggregate(total=Sum('quantity'))['total'] or 0
-        
-        total_cost = Decimal('0')
-        for order in orders:
-            for item in order.items.all():
-                if item.variant and item.variant.cost_price:
-                    total_cost += item.variant.cost_price * item.quantity
-        total_profit = total_revenue - total_cost
-        
-        header_font = Font(bold=True, size=14)
-        header_fill = PatternFill(start_color="C0A464", end_color="C0A464", fill_type="solid")
-        
-        ws['A1'] = f"AURELION Sales Report ({days} Days)"
-        ws['A1'].font = Font(bold=True, size=18)
-        ws.merge_cells('A1:D1')
-        
-        ws['A3'] = "Metric"
-        ws['B3'] = "Value"
-        ws['A3'].font = header_font
-        ws['B3'].font = header_font
-        
-        metrics = [
-            ("Total Revenue", f"${total_revenue:,.2f}"),
-            ("Total Cost", f"${total_cost:,.2f}"),
-            ("Total Profit", f"${total_profit:,.2f}"),
-            ("Profit Margin", f"{(total_profit/total_revenue*100):.1f}%" if total_revenue > 0 else "0%"),
-            ("Total Orders", str(total_orders)),
-            ("Total Items Sold", str(total_items)),
-            ("Average Order Value", f"${avg_order:,.2f}"),
-        ]
-        
-        for i, (metric, value) in enumerate(metrics, start=4):
-            ws[f'A{i}'] = metric
-            ws[f'B{i}'] = value
-        
-        ws.column_dimensions['A'].width = 25
-        ws.column_dimensions['B'].width = 20
-        
-        ws2 = wb.create_sheet("Orders")
-        headers = ['Order Code', 'Date', 'Client', 'Items', 'Total', 'Cashier']
-        for col, header in enumerate(headers, start=1):
-            cell = ws2.cell(row=1, column=col, value=header)
-            cell.font = header_font
-        
-        for row, order in enumerate(orders, start=2):
-            ws2.cell(row=row, column=1, value=order.order_code)
-            ws2.cell(row=row, column=2, value=order.created_at.strftime('%Y-%m-%d %H:%M'))
-            ws2.cell(row=row, column=3, value=str(order.client) if order.client else 'Walk-in')
-            ws2.cell(row=row, column=4, value=order.items.count())
-            ws2.cell(row=row, column=5, value=float(order.total_amount))
-            ws2.cell(row=row, column=6, value=order.created_by.username if order.created_by else '')
-        
-        ws3 = wb.create_sheet("Top Products")
-        headers = ['Product', 'Brand', 'Qty Sold', 'Revenue']
-        for col, header in enumerate(headers, start=1):
-            cell = ws3.cell(row=1, column=col, value=header)
-            cell.font = header_font
-        
-        top_products = OrderItem.objects.filter(order__in=orders).values(
-            'variant__product__name', 'variant__product__brand'
-        ).annotate(
-            total_qty=Sum('quantity'),
-            total_revenue=Sum(F('quantity') * F('unit_price'))
-        ).order_by('-total_revenue')[:20]
-        
-        for row, item in enumerate(top_products, start=2):
-            ws3.cell(row=row, column=1, value=item['variant__product__name'])
-            ws3.cell(row=row, column=2, value=item['variant__product__brand'])
-            ws3.cell(row=row, column=3, value=item['total_qty'])
-            ws3.cell(row=row, column=4, value=float(item['total_revenue']))
-        
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = f'attachment; filename=aurelion_report_{days}days.xlsx'
-        wb.save(response)
+
+        location, error = reports.parse_location(request.GET)
+        if error:
+            messages.error(request, error)
+            return redirect('reports')
+
+        export_format = request.GET.get('format', 'xlsx')
+        if export_format not in exports.CONTENT_TYPES:
+            messages.error(request, f"Unknown export format: {export_format}")
+            return redirect('reports')
+        filename = f'{exports.file_stem(period, location)}.{export_format}'
+
+        if export_format == 'xlsx':
+            if period.days > exports.INLINE_EXPORT_DAYS or request.GET.get('background'):
+                job = jobs.enqueue(BackgroundJob.Kind.REPORT_EXPORT, {
+                    'start': period.start.isoformat(), 'end': period.end.isoformat(),
+                    'location': location.pk if location else None,
+                }, request.user)
+                messages.info(request, 'The export is being prepared in the background.')
+                return redirect('job_detail', pk=job.pk)
+            try:
+                handle = exports.workbook_file(period, reports.cached_report(period, location))
+            except ImportError:
+                messages.error(request, "Excel export requires openpyxl. Install with: pip install openpyxl")
+                return redirect('reports')
+            return FileResponse(handle, as_attachment=True, filename=filename,
+                                content_type=exports.CONTENT_TYPES['xlsx'])
+
+        rows = exports.order_rows(period, location)
+        stream = exports.csv_stream(rows) if export_format == 'csv' else exports.ndjson_stream(rows)
+        response = StreamingHttpResponse(stream, content_type=exports.CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
 
 
+class JobAccessMixin(LoginRequiredMixin):
+    """Background jobs are visible to whoever queued them and to owners"""
+    def get_job(self, pk):
+        job = get_object_or_404(BackgroundJob, pk=pk)
+        if job.created_by_id != self.request.user.id and not self.request.user.is_owner():
+            raise Http404
+        return job
+
+
+def job_payload(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'finished': job.is_finished,
+        'download_url': reverse('job_download', args=[job.pk]) if job.status == BackgroundJob.Status.DONE else None,
+    }
+
+
+class JobDetailView(JobAccessMixin, View):
+    """Progress page that polls JobStatusView until the file is ready"""
+    def get(self, request, pk):
+        job = self.get_job(pk)
+        return render(request, 'core/job_detail.html', {'job': job, 'payload': job_payload(job)})
+
+
+class JobStatusView(JobAccessMixin, View):
+    def get(self, request, pk):
+        return JsonResponse(job_payload(self.get_job(pk)))
+
+
+class JobDownloadView(JobAccessMixin, View):
+    def get(self, request, pk):
+        job = self.get_job(pk)
+        if job.status != BackgroundJob.Status.DONE or not os.path.exists(job.file_path):
+            raise Http404
+        return FileResponse(open(job.file_path, 'rb'), as_attachment=True, filename=job.file_name,
+                            content_type=job.content_type)
+
+
 def health(request):
     """Health check endpoint that tests database connectivity"""
     from django.db import connection